@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+"""
+Times `(sum (map sq (filter p xs)))` over a list of integers, with and
+without the optimizer fusing the calls into a pipeline, and gives the peak
+memory used on top of the list itself.
+
+    python benchmarks/fusion.py N fused|plain [vectorizable|opaque|pure]
+
+With `vectorizable` stages, `map` and `filter` do the integer math on all
+the elements at once. `opaque` stages are called for each element. Only
+`pure` stages, which can neither fail nor have any effect, are fused.
+"""
+
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from diylisp.interpreter import interpret
+from diylisp.types import Environment
+
+stages = {
+    'vectorizable': ("(lambda (x) (> (mod x 3) 1))",
+                     "(lambda (x) (* x x))"),
+    'opaque': ("(lambda (x) (if (eq (mod x 3) 2) #t #f))",
+               "(lambda (x) (* x x))"),
+    'pure': ("(lambda (x) (if (eq x 0) #f (atom x)))",
+             "(lambda (x) (if (eq x 1) 0 x))"),
+}
+
+def peak_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+if __name__ == '__main__':
+    n, mode = int(sys.argv[1]), sys.argv[2]
+    kind = sys.argv[3] if len(sys.argv) > 3 else 'vectorizable'
+    env = Environment()
+    interpret("(define xs (ivec->list (irange 0 %d)))" % n, env)
+    interpret("(define p %s)" % stages[kind][0], env)
+    interpret("(define sq %s)" % stages[kind][1], env)
+    base = peak_mb()
+    start = time.time()
+    result = interpret("(sum (map sq (filter p xs)))", env,
+                       optimize=(mode == 'fused'))
+    print "%s %s %d: %s in %.2fs, peak +%d MB" % (
+        mode, kind, n, result, time.time() - start, peak_mb() - base)
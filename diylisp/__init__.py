@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+# Registers the builtin functions, which every environment sees.
+import natives
+import lazy
+import vectors
+import hashmaps
+import ivecs
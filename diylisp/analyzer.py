@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+
+from types import LispError, Closure, Builtin, Environment, Frame, Promise
+from ast import is_boolean, is_atom, is_symbol, is_list, is_integer
+from asserts import assert_exp_length, assert_valid_definition
+from parser import unparse
+from evaluator import math_operators, keywords, call_builtin
+from lists import cons, head, tail, is_empty
+from ivecs import ivec_math
+import operator
+
+"""
+This is the Analyzer module, an alternative to the tree-walking `evaluate`.
+
+Where `evaluate` inspects every node of the AST each time it is run, `analyze`
+looks at the AST only once and turns it into a tree of Python closures. Each
+closure takes an environment and returns the value of its part of the program.
+All decisions that depend only on the shape of the AST (is this an integer, a
+special form, a math operator?) are made during analysis, so running the
+result does nothing but the actual work.
+
+Variables are resolved during analysis too. Each call to an analyzed lambda
+binds its arguments in a `Frame`, a plain list of values. A reference to a
+parameter of an enclosing lambda is turned into a depth (how many frames to
+go up) and an index into that frame. Any other reference is free, and is
+looked up by name in the environment the analyzed program runs in. Since
+variables can't be redefined, the value found is kept for later runs in the
+same environment, until a definition hides a builtin.
+
+Calls in tail position don't run the body of the closure they call, but
+give it back to the call they return to (see `TailCall`), so tail recursive
+loops run in constant Python stack like they do with `evaluate`.
+
+The semantics, including the error messages, are those of `evaluate`.
+"""
+
+class Scope:
+    """The parameters of a lambda enclosing the expression being analyzed.
+
+    A scope is dynamic if the body of its lambda contains a `define`, which
+    adds a binding to the frame at run time. References which are not to
+    parameters of lambdas inside such a scope must be looked up by name."""
+
+    def __init__(self, params, parent, dynamic=False):
+        self.params = params
+        self.parent = parent
+        self.dynamic = dynamic
+
+def resolve(symbol, scope):
+    """Find where a symbol is bound, as seen from the specified scope.
+
+    Returns `(depth, index)` for a parameter, `(depth, None)` for a free
+    variable, where depth is the number of frames to go up to reach the
+    environment the program runs in, or `None` if the symbol must be
+    looked up by name."""
+    depth = 0
+    while scope is not None:
+        if symbol in scope.params:
+            return depth, list(scope.params).index(symbol)
+        if scope.dynamic:
+            return None
+        depth += 1
+        scope = scope.parent
+    return depth, None
+
+class TailCall(object):
+    """A call to a closure in tail position, made by the caller instead.
+
+    The procedure of a call in tail position gives back the body and the
+    frame of the call rather than running the body, so a loop written as a
+    tail recursive function runs in constant Python stack (see
+    `run_body`)."""
+
+    __slots__ = ('body', 'frame')
+
+    def __init__(self, body, frame):
+        self.body = body
+        self.frame = frame
+
+def run_body(body, frame):
+    """Run the procedure of a closure body, and the calls in tail position
+    it gives back, until there is a value."""
+    value = body(frame)
+    while type(value) is TailCall:
+        value = value.body(value.frame)
+    return value
+
+def analyze(ast, scope=None, tail=False):
+    """Turn an AST into a procedure taking an environment.
+
+    If `tail` is true, the AST is the body of a closure or in tail position
+    within it, and the procedure may give a `TailCall`."""
+    if is_boolean(ast) or is_integer(ast):
+        return analyze_constant(ast)
+    elif is_symbol(ast):
+        return analyze_variable(ast, scope)
+    elif is_list(ast):
+        if len(ast) > 0 and is_symbol(ast[0]):
+            if ast[0] in special_forms:
+                return analyze_special_form(ast, scope, tail)
+            elif ast[0] in math_operators:
+                return analyze_math(ast, scope)
+        return analyze_call(ast, scope, tail)
+    return analyze_constant(ast)
+
+def execute(ast, env):
+    """Analyze an AST and run it in the specified environment."""
+    return analyze(ast)(env)
+
+def analyze_constant(value):
+    return lambda env: value
+
+def analyze_variable(symbol, scope):
+    location = resolve(symbol, scope)
+    if location is None:
+        return lambda env: env.lookup(symbol)
+
+    depth, index = location
+    if index is None:
+        return analyze_free_variable(symbol, depth)
+    elif depth == 0:
+        return lambda env: env.values[index]
+    elif depth == 1:
+        return lambda env: env.parent.values[index]
+
+    def parameter(env):
+        for _ in xrange(depth):
+            env = env.parent
+        return env.values[index]
+    return parameter
+
+def analyze_free_variable(symbol, depth):
+    """Look up a free variable, caching the result.
+
+    The cache holds the environment the variable was last looked up in,
+    together with the value found and `Environment.builtins_hidden` at the
+    time. It is replaced as a whole, so it is always consistent."""
+    cache = [(None, None, None)]
+
+    def free_variable(env):
+        for _ in xrange(depth):
+            env = env.parent
+        cached_env, value, hidden = cache[0]
+        if env is cached_env and hidden == Environment.builtins_hidden:
+            return value
+        value = env.lookup(symbol)
+        cache[0] = (env, value, Environment.builtins_hidden)
+        return value
+    return free_variable
+
+def analyze_special_form(ast, scope, tail=False):
+    """Analyze one of the special forms.
+
+    Malformed forms are reported when they are run, not when they are
+    analyzed, just like `evaluate` only complains about the branches of
+    the program it actually visits."""
+    try:
+        if tail and ast[0] in tail_forms:
+            return tail_forms[ast[0]](ast, scope, True)
+        return special_forms[ast[0]](ast, scope)
+    except LispError, e:
+        def fail(env):
+            raise e
+        return fail
+
+def analyze_math(ast, scope):
+    op = math_operators[ast[0]]
+    procs = [analyze(x, scope) for x in ast[1:]]
+
+    if len(procs) == 2:
+        left, right = procs
+        def math(env):
+            a = left(env)
+            b = right(env)
+            if not (isinstance(a, int) and isinstance(b, int)):
+                return ivec_math(op, [a, b])
+            return op(a, b)
+        return math
+
+    def math(env):
+        args = [proc(env) for proc in procs]
+        if not (reduce(operator.and_, [is_integer(x) for x in args])):
+            return ivec_math(op, args)
+        return reduce(op, args)
+    return math
+
+def analyze_quote(ast, scope):
+    assert_exp_length(ast, 2)
+    return analyze_constant(ast[1])
+
+def analyze_atom(ast, scope):
+    assert_exp_length(ast, 2)
+    proc = analyze(ast[1], scope)
+    return lambda env: is_atom(proc(env))
+
+def analyze_eq(ast, scope):
+    assert_exp_length(ast, 3)
+    left, right = analyze(ast[1], scope), analyze(ast[2], scope)
+    def eq(env):
+        a = left(env)
+        b = right(env)
+        return is_atom(a) and a == b
+    return eq
+
+def analyze_if(ast, scope, tail=False):
+    assert_exp_length(ast, 4)
+    predicate = analyze(ast[1], scope)
+    consequent = analyze(ast[2], scope, tail)
+    alternative = analyze(ast[3], scope, tail)
+    def if_(env):
+        if predicate(env):
+            return consequent(env)
+        return alternative(env)
+    return if_
+
+def analyze_and(ast, scope, tail=False):
+    if len(ast) == 1:
+        return analyze_constant(True)
+    first = [analyze(x, scope) for x in ast[1:-1]]
+    last = analyze(ast[-1], scope, tail)
+    def and_(env):
+        for proc in first:
+            if not proc(env):
+                return False
+        return last(env)
+    return and_
+
+def analyze_or(ast, scope, tail=False):
+    if len(ast) == 1:
+        return analyze_constant(False)
+    first = [analyze(x, scope) for x in ast[1:-1]]
+    last = analyze(ast[-1], scope, tail)
+    def or_(env):
+        for proc in first:
+            if proc(env):
+                return True
+        return last(env)
+    return or_
+
+def analyze_define(ast, scope):
+    assert_valid_definition(ast[1:])
+    symbol = ast[1]
+    proc = analyze(ast[2], scope)
+    def define(env):
+        env.set(symbol, proc(env))
+        return ""
+    return define
+
+def contains_define(ast):
+    """Whether evaluating the AST may define a variable in the current frame."""
+    if not is_list(ast) or len(ast) == 0:
+        return False
+    elif ast[0] == 'define':
+        return True
+    elif ast[0] in ('quote', 'lambda'):
+        return False
+    return any(contains_define(x) for x in ast)
+
+def analyze_lambda(ast, scope):
+    assert_exp_length(ast, 3)
+    if not is_list(ast[1]):
+        raise LispError('non-list: %s' % unparse(ast[1]))
+    params, body = ast[1], ast[2]
+    body_proc = analyze(body, Scope(params, scope, contains_define(body)), True)
+    def make_closure(env):
+        closure = Closure(env, params, body)
+        closure.proc = body_proc
+        return closure
+    return make_closure
+
+def analyze_delay(ast, scope):
+    assert_exp_length(ast, 2)
+    proc = analyze(ast[1], scope)
+    return lambda env: Promise(lambda: proc(env))
+
+def analyze_cons(ast, scope):
+    assert_exp_length(ast, 3)
+    first, rest = analyze(ast[1], scope), analyze(ast[2], scope)
+    def cons_(env):
+        h = first(env)
+        return cons(h, rest(env))
+    return cons_
+
+def analyze_head(ast, scope):
+    assert_exp_length(ast, 2)
+    proc = analyze(ast[1], scope)
+    return lambda env: head(proc(env))
+
+def analyze_tail(ast, scope):
+    assert_exp_length(ast, 2)
+    proc = analyze(ast[1], scope)
+    return lambda env: tail(proc(env))
+
+def analyze_empty(ast, scope):
+    assert_exp_length(ast, 2)
+    proc = analyze(ast[1], scope)
+    return lambda env: is_empty(proc(env))
+
+special_forms = {
+        'quote' : analyze_quote,
+        'atom' : analyze_atom,
+        'eq' : analyze_eq,
+        'if' : analyze_if,
+        'and' : analyze_and,
+        'or' : analyze_or,
+        'define' : analyze_define,
+        'lambda' : analyze_lambda,
+        'delay' : analyze_delay,
+        'cons' : analyze_cons,
+        'head' : analyze_head,
+        'tail' : analyze_tail,
+        'empty' : analyze_empty
+        }
+
+# The special forms with parts in tail position when the form itself is.
+tail_forms = {
+        'if' : analyze_if,
+        'and' : analyze_and,
+        'or' : analyze_or
+        }
+
+def closure_proc(closure):
+    """Analyze the body of a closure made by `evaluate`.
+
+    This happens the first time such a closure is called from analyzed
+    code. The result is kept on the closure."""
+    body = closure.body
+    closure.proc = analyze(body, Scope(closure.params, None, contains_define(body)), True)
+    return closure.proc
+
+def call_closure(closure, args):
+    """Call a closure with arguments which are already evaluated, and of
+    the right number. This is how builtins call back into analyzed code."""
+    try:
+        body = closure.proc
+    except AttributeError:
+        body = closure_proc(closure)
+    return run_body(body, Frame(closure.params, list(args), closure.env))
+
+def analyze_call(ast, scope, tail=False):
+    function = analyze(ast[0], scope)
+    arg_procs = [analyze(x, scope) for x in ast[1:]]
+    num_args = len(arg_procs)
+
+    def call(env):
+        closure = function(env)
+        if not isinstance(closure, Closure):
+            if isinstance(closure, Builtin):
+                return call_builtin(closure, [proc(env) for proc in arg_procs],
+                                    call_closure)
+            raise LispError('not a function: %s' % unparse(closure))
+        args = [proc(env) for proc in arg_procs]
+        params = closure.params
+        if num_args != len(params):
+            raise LispError('wrong number of arguments, expected %d got %d'
+                    % (len(params), num_args))
+        try:
+            body = closure.proc
+        except AttributeError:
+            body = closure_proc(closure)
+        if tail:
+            return TailCall(body, Frame(params, args, closure.env))
+        return run_body(body, Frame(params, args, closure.env))
+    return call
+
+def unbound_variables(ast, env, scope=None):
+    """Find the free variables of an AST which are not bound in `env`.
+
+    Variables defined by the program itself count as bound. This lets
+    misspelled names be reported before a program is run."""
+    defined = set()
+    free = set()
+
+    def visit(ast, scope):
+        if is_symbol(ast):
+            location = resolve(ast, scope)
+            if location is not None and location[1] is None:
+                free.add(ast)
+        elif is_list(ast) and len(ast) > 0:
+            head = ast[0]
+            if head == 'quote':
+                return
+            elif head == 'lambda' and len(ast) == 3 and is_list(ast[1]):
+                visit(ast[2], Scope(ast[1], scope))
+                return
+            elif head == 'define' and len(ast) == 3 and is_symbol(ast[1]):
+                defined.add(ast[1])
+                visit(ast[2], scope)
+                return
+            elif not (head in keywords or head in math_operators):
+                visit(head, scope)
+            for x in ast[1:]:
+                visit(x, scope)
+
+    visit(ast, scope)
+    return sorted(x for x in free - defined if not env.defines(x))
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
-from types import Closure
+from array import array
+
+from types import Closure, Builtin, Cons, ListView, LazySeq, Promise, Vector, \
+    HashMap
 
 """
 This module contains a few simple helper functions for 
@@ -11,7 +14,19 @@ def is_symbol(x):
     return isinstance(x, str)
 
 def is_list(x):
-    return isinstance(x, list)
+    return isinstance(x, (list, Cons, ListView, LazySeq))
+
+def is_vector(x):
+    return isinstance(x, Vector)
+
+def is_ivec(x):
+    return isinstance(x, array)
+
+def is_hash_map(x):
+    return isinstance(x, HashMap)
+
+def is_promise(x):
+    return isinstance(x, Promise)
 
 def is_boolean(x):
     return isinstance(x, bool)
@@ -22,8 +37,12 @@ def is_integer(x):
 def is_closure(x):
     return isinstance(x, Closure)
 
+def is_builtin(x):
+    return isinstance(x, Builtin)
+
 def is_atom(x):
     return is_symbol(x) \
         or is_integer(x) \
         or is_boolean(x) \
-        or is_closure(x)
+        or is_closure(x) \
+        or is_builtin(x)
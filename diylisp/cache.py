@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+from hashlib import sha1
+from os.path import dirname
+import marshal
+import os
+import sys
+import tempfile
+
+from parser import parse_forms
+
+"""
+A cache of parsed source files, like the `.pyc` files of Python.
+
+The expressions of `foo.diy` are kept in `foo.diyc` next to it, in
+`marshal` format. The cache is keyed by a hash of the source together with
+`cache_version` and the Python version, so it is used only for exactly the
+same source read the same way. A cache file which is missing, stale or
+damaged in any way is ignored, and written again once the whole source has
+been parsed. Failing to write it is not an error, and neither are
+expressions nested too deeply for `marshal`, which are simply not cached.
+
+Only small files are cached, since all their expressions are kept until the
+cache is written (see `interpreter.cache_threshold`). Only the parsed
+expressions are kept. What the optimizer and the compiler
+make of them depends on the environment they are evaluated in.
+"""
+
+# Change this whenever the parser or the format of ASTs changes.
+cache_version = 1
+
+magic = 'DIYC'
+
+def cache_path(filename):
+    return filename + 'c'
+
+def cache_key(source):
+    key = sha1('%d %d.%d\n' % ((cache_version,) + sys.version_info[:2]))
+    key.update(source)
+    return key.digest()
+
+def cached_forms(filename, source):
+    """The expressions of the source read from `filename`.
+
+    This is a generator, like `parser.read_forms`. If there is no usable
+    cache the source is parsed, and the expressions are cached once they
+    have all been read."""
+    key = cache_key(source)
+    forms = load(cache_path(filename), key)
+    if forms is not None:
+        for ast in forms:
+            yield ast
+        return
+    forms = []
+    for ast in parse_forms(source):
+        forms.append(ast)
+        yield ast
+    save(cache_path(filename), key, forms)
+
+def load(path, key):
+    """The expressions cached in `path` for `key`, or None."""
+    try:
+        with open(path, 'rb') as cachefile:
+            data = cachefile.read()
+    except IOError:
+        return None
+    header = len(magic) + 2 * sha1().digest_size
+    if len(data) < header or not data.startswith(magic):
+        return None
+    stored_key = data[len(magic):len(magic) + sha1().digest_size]
+    checksum = data[len(magic) + sha1().digest_size:header]
+    payload = data[header:]
+    if stored_key != key or sha1(payload).digest() != checksum:
+        return None
+    try:
+        forms = marshal.loads(payload)
+    except (ValueError, EOFError, TypeError):
+        return None
+    return forms if isinstance(forms, list) else None
+
+def save(path, key, forms):
+    """Write the cache file, by renaming a complete temporary file."""
+    try:
+        payload = marshal.dumps(forms)
+    except ValueError:
+        # Nested too deeply.
+        return
+    try:
+        fd, temporary = tempfile.mkstemp(dir=dirname(path) or '.')
+    except (IOError, OSError):
+        return
+    try:
+        with os.fdopen(fd, 'wb') as cachefile:
+            cachefile.write(magic + key + sha1(payload).digest() + payload)
+        os.rename(temporary, path)
+    except (IOError, OSError):
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
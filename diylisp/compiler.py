@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+from types import LispError
+from ast import is_boolean, is_symbol, is_list, is_integer
+from asserts import assert_exp_length, assert_valid_definition
+from parser import unparse
+from evaluator import math_operators
+
+"""
+This is the Compiler module. It lowers ASTs into flat lists of instructions
+for the stack based virtual machine in `vm.py`.
+
+Every instruction is a tuple `(opcode, argument)`. Values are passed between
+instructions on the value stack of the machine. A compiled program, as well
+as the compiled body of every lambda, ends with a `RETURN`.
+
+Example:
+
+    >>> disassemble(compile_ast(parse("(if (> x 1) 'big 'small)")))
+    0 LOOKUP x
+    1 CONST 1
+    2 MATH (gt, 2)
+    3 JUMP_IF_FALSE 6
+    4 CONST big
+    5 RETURN None
+    6 CONST small
+    7 RETURN None
+"""
+
+opnames = [
+        'CONST',
+        'LOOKUP',
+        'MATH',
+        'ATOM',
+        'EQ',
+        'JUMP',
+        'JUMP_IF_FALSE',
+        'JUMP_IF_TRUE',
+        'DEFINE',
+        'LAMBDA',
+        'DELAY',
+        'CONS',
+        'HEAD',
+        'TAIL',
+        'EMPTY',
+        'FUNCTION',
+        'CALL',
+        'RETURN',
+        'FAIL']
+
+(CONST, LOOKUP, MATH, ATOM, EQ, JUMP, JUMP_IF_FALSE, JUMP_IF_TRUE, DEFINE,
+ LAMBDA, DELAY, CONS, HEAD, TAIL, EMPTY, FUNCTION, CALL, RETURN,
+ FAIL) = range(len(opnames))
+
+def compile_ast(ast):
+    """Compile an AST into a list of instructions.
+
+    Jumps straight to a `RETURN` are replaced by a `RETURN`, so that calls
+    in the branches of an `if`, `and` or `or` are followed by one, which
+    makes them tail calls."""
+    code = []
+    compile_into(ast, code)
+    code.append((RETURN, None))
+    for pc, (op, arg) in enumerate(code):
+        if op == JUMP and code[arg][0] == RETURN:
+            code[pc] = (RETURN, None)
+    return code
+
+def compile_into(ast, code):
+    """Append the instructions for an AST to `code`."""
+    if is_boolean(ast) or is_integer(ast):
+        code.append((CONST, ast))
+    elif is_symbol(ast):
+        code.append((LOOKUP, ast))
+    elif is_list(ast):
+        if len(ast) > 0 and is_symbol(ast[0]):
+            if ast[0] in special_forms:
+                return compile_special_form(ast, code)
+            elif ast[0] in math_operators:
+                return compile_math(ast, code)
+        compile_call(ast, code)
+    else:
+        code.append((CONST, ast))
+
+def compile_special_form(ast, code):
+    """Compile one of the special forms.
+
+    A malformed form is compiled into a `FAIL` instruction, so that the
+    error is raised only if the form is actually run."""
+    start = len(code)
+    try:
+        special_forms[ast[0]](ast, code)
+    except LispError, e:
+        del code[start:]
+        code.append((FAIL, e))
+
+def compile_math(ast, code):
+    for x in ast[1:]:
+        compile_into(x, code)
+    code.append((MATH, (math_operators[ast[0]], len(ast) - 1)))
+
+def compile_quote(ast, code):
+    assert_exp_length(ast, 2)
+    code.append((CONST, ast[1]))
+
+def compile_atom(ast, code):
+    assert_exp_length(ast, 2)
+    compile_into(ast[1], code)
+    code.append((ATOM, None))
+
+def compile_eq(ast, code):
+    assert_exp_length(ast, 3)
+    compile_into(ast[1], code)
+    compile_into(ast[2], code)
+    code.append((EQ, None))
+
+def compile_if(ast, code):
+    assert_exp_length(ast, 4)
+    compile_into(ast[1], code)
+    jump_to_alternative = len(code)
+    code.append(None)
+    compile_into(ast[2], code)
+    jump_to_end = len(code)
+    code.append(None)
+    code[jump_to_alternative] = (JUMP_IF_FALSE, len(code))
+    compile_into(ast[3], code)
+    code[jump_to_end] = (JUMP, len(code))
+
+def compile_and(ast, code):
+    compile_short_circuit(ast, code, JUMP_IF_FALSE, False)
+
+def compile_or(ast, code):
+    compile_short_circuit(ast, code, JUMP_IF_TRUE, True)
+
+def compile_short_circuit(ast, code, jump, value):
+    """Compile an `and` or an `or`.
+
+    Each argument but the last is followed by a `jump` to the end, giving
+    `value` as result. Otherwise the result is that of the last argument."""
+    if len(ast) == 1:
+        code.append((CONST, not value))
+        return
+    jumps = []
+    for x in ast[1:-1]:
+        compile_into(x, code)
+        jumps.append(len(code))
+        code.append(None)
+    compile_into(ast[-1], code)
+    if jumps:
+        code.append((JUMP, len(code) + 2))
+        for pc in jumps:
+            code[pc] = (jump, len(code))
+        code.append((CONST, value))
+
+def compile_define(ast, code):
+    assert_valid_definition(ast[1:])
+    compile_into(ast[2], code)
+    code.append((DEFINE, ast[1]))
+
+def compile_lambda(ast, code):
+    assert_exp_length(ast, 3)
+    if not is_list(ast[1]):
+        raise LispError('non-list: %s' % unparse(ast[1]))
+    code.append((LAMBDA, (ast[1], ast[2], compile_ast(ast[2]))))
+
+def compile_delay(ast, code):
+    assert_exp_length(ast, 2)
+    code.append((DELAY, (ast[1], compile_ast(ast[1]))))
+
+def compile_cons(ast, code):
+    assert_exp_length(ast, 3)
+    compile_into(ast[1], code)
+    compile_into(ast[2], code)
+    code.append((CONS, None))
+
+def compile_head(ast, code):
+    assert_exp_length(ast, 2)
+    compile_into(ast[1], code)
+    code.append((HEAD, None))
+
+def compile_tail(ast, code):
+    assert_exp_length(ast, 2)
+    compile_into(ast[1], code)
+    code.append((TAIL, None))
+
+def compile_empty(ast, code):
+    assert_exp_length(ast, 2)
+    compile_into(ast[1], code)
+    code.append((EMPTY, None))
+
+special_forms = {
+        'quote' : compile_quote,
+        'atom' : compile_atom,
+        'eq' : compile_eq,
+        'if' : compile_if,
+        'and' : compile_and,
+        'or' : compile_or,
+        'define' : compile_define,
+        'lambda' : compile_lambda,
+        'delay' : compile_delay,
+        'cons' : compile_cons,
+        'head' : compile_head,
+        'tail' : compile_tail,
+        'empty' : compile_empty
+        }
+
+def compile_call(ast, code):
+    """Compile a function call.
+
+    The function is evaluated and checked before the arguments, which is
+    the order `evaluate` does things in."""
+    compile_into(ast[0], code)
+    code.append((FUNCTION, None))
+    for x in ast[1:]:
+        compile_into(x, code)
+    code.append((CALL, len(ast) - 1))
+
+def disassemble(code):
+    """Return a readable listing of compiled instructions."""
+    lines = []
+    for pc, (op, arg) in enumerate(code):
+        if op == MATH:
+            arg = "(%s, %d)" % (arg[0].__name__, arg[1])
+        elif op == LAMBDA:
+            arg = "(lambda %s %s)" % (unparse(arg[0]), unparse(arg[1]))
+        elif op == DELAY:
+            arg = "(delay %s)" % unparse(arg[0])
+        elif op == CONST:
+            arg = unparse(arg)
+        lines.append("%d %s %s" % (pc, opnames[op], arg))
+    return "\n".join(lines)
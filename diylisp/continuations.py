@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+from types import LispError, Closure, Builtin, Promise
+from ast import is_atom, is_list, is_integer
+from asserts import assert_exp_length, assert_valid_definition
+from parser import unparse
+from evaluator import math_operators, call_builtin
+from lists import cons, head, tail, is_empty
+from ivecs import ivec_math
+import operator
+
+"""
+This module holds an evaluator which keeps its control stack on the heap.
+
+`evaluate` uses the Python stack to remember what to do with the value of a
+sub-expression once it is known, so programs recursing in non-tail position
+(like `sum` or `map` from the stdlib) run out of Python stack after a few
+hundred elements. Here the rest of the computation is instead kept as an
+explicit stack of continuation frames, which is limited only by memory.
+
+The machine alternates between two things: evaluating an expression, which
+either gives a value right away or pushes a frame and moves on to a
+sub-expression; and returning a value to the frame on top of the stack.
+"""
+
+# The kinds of continuation frames.
+IF, AND_OR, DEFINE, ARGUMENTS = range(4)
+
+def apply_math(name, args):
+    if not (reduce(operator.and_, [is_integer(x) for x in args])):
+        return ivec_math(math_operators[name], args)
+    return reduce(math_operators[name], args)
+
+def apply_atom(name, args):
+    return is_atom(args[0])
+
+def apply_eq(name, args):
+    return is_atom(args[0]) and args[0] == args[1]
+
+def apply_cons(name, args):
+    return cons(args[0], args[1])
+
+def apply_head(name, args):
+    return head(args[0])
+
+def apply_tail(name, args):
+    return tail(args[0])
+
+def apply_empty(name, args):
+    return is_empty(args[0])
+
+# The forms which evaluate all their arguments, with the expected length of
+# the form (None meaning any length) and the function combining the values.
+primitives = {
+        'atom' : (2, apply_atom),
+        'eq' : (3, apply_eq),
+        'cons' : (3, apply_cons),
+        'head' : (2, apply_head),
+        'tail' : (2, apply_tail),
+        'empty' : (2, apply_empty)
+        }
+
+for name in math_operators:
+    primitives[name] = (None, apply_math)
+
+def call_closure(closure, args):
+    """Call a closure with arguments which are already evaluated, and of
+    the right number. This is how builtins call back into this evaluator,
+    which keeps its stack on the heap for them too."""
+    return execute(closure.body, closure.env.extend(dict(zip(closure.params, args))))
+
+def delayed(ast, env):
+    """A thunk evaluating an expression, for `delay`."""
+    return lambda: execute(ast, env)
+
+def execute(ast, env):
+    """Evaluate an Abstract Syntax Tree in the specified environment."""
+    stack = []
+    while True:
+        # Evaluate `ast`. Either we get a value, or we push a frame and
+        # continue with one of its sub-expressions.
+        kind = type(ast)
+        if kind is str:
+            value = env.lookup(ast)
+        elif kind is not list:
+            value = ast
+        else:
+            head = ast[0]
+            if type(head) is str and head in primitives:
+                length, _ = primitives[head]
+                if length is not None:
+                    assert_exp_length(ast, length)
+                if len(ast) == 1:
+                    value = primitives[head][1](head, [])
+                else:
+                    stack.append([ARGUMENTS, head, ast, env, []])
+                    ast = ast[1]
+                    continue
+            elif head == 'if':
+                assert_exp_length(ast, 4)
+                stack.append([IF, ast, env])
+                ast = ast[1]
+                continue
+            elif head == 'and' or head == 'or':
+                if len(ast) == 1:
+                    value = head == 'and'
+                else:
+                    # The last argument is in tail position, so no frame
+                    # is kept while it is evaluated.
+                    if len(ast) > 2:
+                        stack.append([AND_OR, ast, env, 1])
+                    ast = ast[1]
+                    continue
+            elif head == 'quote':
+                assert_exp_length(ast, 2)
+                value = ast[1]
+            elif head == 'lambda':
+                assert_exp_length(ast, 3)
+                if not is_list(ast[1]):
+                    raise LispError('non-list: %s' % unparse(ast[1]))
+                value = Closure(env, ast[1], ast[2])
+            elif head == 'delay':
+                assert_exp_length(ast, 2)
+                value = Promise(delayed(ast[1], env))
+            elif head == 'define':
+                assert_valid_definition(ast[1:])
+                stack.append([DEFINE, ast[1], env])
+                ast = ast[2]
+                continue
+            else:
+                # A function call. The function is the first value collected.
+                stack.append([ARGUMENTS, None, ast, env, []])
+                ast = head
+                continue
+
+        # Return `value` to the frames on the stack, until one of them has
+        # another expression to evaluate.
+        while stack:
+            frame = stack[-1]
+            kind = frame[0]
+            if kind == ARGUMENTS:
+                name, exps, values = frame[1], frame[2], frame[4]
+                if name is None:
+                    if not values and not isinstance(value, (Closure, Builtin)):
+                        raise LispError('not a function: %s' % unparse(value))
+                    values.append(value)
+                    if len(values) < len(exps):
+                        ast, env = exps[len(values)], frame[3]
+                        break
+                    stack.pop()
+                    closure, args = values[0], values[1:]
+                    if isinstance(closure, Builtin):
+                        # The builtin may walk past the cells of a lazy list.
+                        del values[:], value
+                        value = call_builtin(closure, args, call_closure)
+                        continue
+                    num_params = len(closure.params)
+                    if len(args) != num_params:
+                        raise LispError('wrong number of arguments, expected %d got %d'
+                                % (num_params, len(args)))
+                    ast = closure.body
+                    env = closure.env.extend(dict(zip(closure.params, args)))
+                    break
+                values.append(value)
+                if len(values) < len(exps) - 1:
+                    ast, env = exps[len(values) + 1], frame[3]
+                    break
+                stack.pop()
+                value = primitives[name][1](name, values)
+            elif kind == IF:
+                stack.pop()
+                ast, env = frame[1][2] if value else frame[1][3], frame[2]
+                break
+            elif kind == AND_OR:
+                exps, index = frame[1], frame[3] + 1
+                if bool(value) != (exps[0] == 'and'):
+                    stack.pop()
+                    value = bool(value)
+                    continue
+                if index == len(exps) - 1:
+                    stack.pop()
+                frame[3] = index
+                ast, env = exps[index], frame[2]
+                break
+            else:
+                stack.pop()
+                frame[2].set(frame[1], value)
+                value = ""
+        else:
+            return value
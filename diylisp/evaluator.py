@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 
-from types import Environment, LispError, Closure
-from ast import is_boolean, is_atom, is_symbol, is_list, is_closure, is_integer
+from types import Environment, LispError, Closure, Promise, LazySeq, Cursor
+from ast import is_boolean, is_atom, is_symbol, is_list, is_closure, is_integer, \
+    is_builtin
 from asserts import assert_exp_length, assert_valid_definition, assert_boolean
 from parser import unparse
+from lists import cons, head, tail, is_empty
+import ivecs
 import operator
 
 """
@@ -26,7 +29,7 @@ math_operators = {
 def eval_math(ast, env):
     args = [evaluate(x, env) for x in ast[1:]]
     if not (reduce(operator.and_, [is_integer(x) for x in args])):
-        raise LispError('Arguments must be integers.')
+        return ivecs.ivec_math(math_operators[ast[0]], args)
     return reduce(math_operators[ast[0]], args)
 
 def eval_quote(ast, env):
@@ -43,8 +46,39 @@ def eval_eq(ast, env):
     return is_atom(args[0]) and args[0] == args[1]
 
 def eval_if(ast, env):
+    return evaluate(tail_if(ast, env), env)
+
+def eval_and(ast, env):
+    return evaluate(tail_and(ast, env), env)
+
+def eval_or(ast, env):
+    return evaluate(tail_or(ast, env), env)
+
+##
+## The forms below decide which expression to evaluate in their place,
+## and return it instead of its value. This lets `evaluate` handle the
+## expression in tail position without making a recursive call.
+##
+
+def tail_if(ast, env):
     assert_exp_length(ast, 4)
-    return evaluate(ast[2] if evaluate(ast[1], env) else ast[3], env)
+    return ast[2] if evaluate(ast[1], env) else ast[3]
+
+def tail_and(ast, env):
+    """Evaluate the arguments from left to right, stopping at the first false
+    one. Gives #f if there is one, otherwise the value of the last argument."""
+    for x in ast[1:-1]:
+        if not evaluate(x, env):
+            return False
+    return ast[-1] if len(ast) > 1 else True
+
+def tail_or(ast, env):
+    """Evaluate the arguments from left to right, stopping at the first true
+    one. Gives #t if there is one, otherwise the value of the last argument."""
+    for x in ast[1:-1]:
+        if evaluate(x, env):
+            return True
+    return ast[-1] if len(ast) > 1 else False
 
 def eval_define(ast, env):
     assert_valid_definition(ast[1:])
@@ -57,66 +91,180 @@ def eval_lambda(ast, env):
         raise LispError('non-list: %s' % unparse(ast[1]))
     return Closure(env, ast[1], ast[2])
 
+def eval_delay(ast, env):
+    assert_exp_length(ast, 2)
+    return Promise(lambda: evaluate(ast[1], env))
+
 def eval_cons(ast, env):
     assert_exp_length(ast, 3)
     args = [evaluate(x, env) for x in ast[1:]]
-    return [args[0]] + args[1]
+    return cons(args[0], args[1])
 
 def eval_head(ast, env):
     assert_exp_length(ast, 2)
     args = [evaluate(x, env) for x in ast[1:]]
-    if len(args[0]) == 0:
-        raise LispError('empty list')
-    return args[0][0]
+    return head(args[0])
 
 def eval_tail(ast, env):
     assert_exp_length(ast, 2)
     args = [evaluate(x, env) for x in ast[1:]]
-    return args[0][1:]
+    return tail(args[0])
 
 def eval_empty(ast, env):
     assert_exp_length(ast, 2)
     args = [evaluate(x, env) for x in ast[1:]]
-    return (len(args[0]) == 0)
+    return is_empty(args[0])
 
 keywords = {
         'quote' : eval_quote,
         'atom' : eval_atom,
         'eq' : eval_eq,
         'if' : eval_if,
+        'and' : eval_and,
+        'or' : eval_or,
         'define' : eval_define,
         'lambda' : eval_lambda,
+        'delay' : eval_delay,
         'cons' : eval_cons,
         'head' : eval_head,
         'tail' : eval_tail,
         'empty' : eval_empty
         }
 
+tail_keywords = {
+        'if' : tail_if,
+        'and' : tail_and,
+        'or' : tail_or
+        }
+
+# Counts of how often `lookup_function` could use its cache.
+cache_stats = {'hits': 0, 'misses': 0}
+
+def lookup_function(ast, env):
+    """Look up the function called by a call site with a symbol as head.
+
+    Symbols bound in the current frame are looked up directly. For other
+    symbols, the function found is cached per call site next to the outer
+    environment it was resolved against. Since variables can't be
+    redefined, the cached function stays valid for that environment, unless
+    a builtin has been hidden by a definition since it was cached.
+    Every call to a closure uses the environment of the closure as outer
+    environment, so repeated calls from inside a function body hit the
+    cache. The AST itself is never changed."""
+    symbol = ast[0]
+    variables = env.variables
+    if symbol in variables:
+        return variables[symbol]
+    outer = env.parent
+    if outer is None:
+        return env.lookup(symbol)
+
+    sites = outer.call_sites
+    if sites is None:
+        sites = outer.call_sites = {}
+    entry = sites.get(id(ast))
+    if entry is not None and entry[0] is ast \
+            and entry[2] == Environment.builtins_hidden:
+        cache_stats['hits'] += 1
+        return entry[1]
+    cache_stats['misses'] += 1
+    function = outer.lookup(symbol)
+    sites[id(ast)] = (ast, function, Environment.builtins_hidden)
+    return function
+
 def evaluate(ast, env):
-    """Evaluate an Abstract Syntax Tree in the specified environment."""
-    if is_boolean(ast) or is_integer(ast):
-        return ast
-    elif is_symbol(ast):
-        return env.lookup(ast)
-
-    if not is_atom(ast[0]):
-        ast[0] = evaluate(ast[0], env)
-    elif is_symbol(ast[0]):
-        if ast[0] in keywords:
-            return keywords[ast[0]](ast, env)
-        elif ast[0] in math_operators:
-            return eval_math(ast, env)
-        else:
-            ast[0] = env.lookup(ast[0])
-
-    if is_closure(ast[0]):
-        args = [evaluate(x, env) for x in ast[1:]]
-        num_args = len(args)
-        num_params = len(ast[0].params)
-        if num_args != num_params:
-            raise LispError('wrong number of arguments, expected %d got %d'
-                    % (num_params, num_args))
-        bindings = dict(zip(ast[0].params, args))
-        return evaluate(ast[0].body, ast[0].env.extend(bindings))
-
-    raise LispError('not a function: %s' % unparse(ast[0]))
+    """Evaluate an Abstract Syntax Tree in the specified environment.
+
+    Expressions in tail position, such as the chosen branch of an `if` and
+    the body of a called closure, are evaluated by the loop below instead of by a
+    recursive call. Loops written as tail calls thus run in constant space
+    on the Python stack."""
+    while True:
+        if is_boolean(ast) or is_integer(ast):
+            return ast
+        elif is_symbol(ast):
+            return env.lookup(ast)
+
+        function = ast[0]
+        if not is_atom(function):
+            function = evaluate(function, env)
+        elif is_symbol(function):
+            if function in tail_keywords:
+                ast = tail_keywords[function](ast, env)
+                continue
+            elif function in keywords:
+                return keywords[function](ast, env)
+            elif function in math_operators:
+                return eval_math(ast, env)
+            else:
+                function = lookup_function(ast, env)
+
+        if is_closure(function):
+            args = [evaluate(x, env) for x in ast[1:]]
+            num_args = len(args)
+            num_params = len(function.params)
+            if num_args != num_params:
+                raise LispError('wrong number of arguments, expected %d got %d'
+                        % (num_params, num_args))
+            bindings = dict(zip(function.params, args))
+            ast, env = function.body, function.env.extend(bindings)
+            continue
+        elif is_builtin(function):
+            return call_builtin(function, [evaluate(x, env) for x in ast[1:]])
+
+        raise LispError('not a function: %s' % unparse(function))
+
+def call_closure(closure, args):
+    """Call a closure with arguments which are already evaluated, and
+    of the right number, the way `evaluate` does."""
+    return evaluate(closure.body,
+                    closure.env.extend(dict(zip(closure.params, args))))
+
+# How the builtins being called call back into Lisp: the `call_closure` of
+# each engine which called a builtin, the innermost last.
+engine_calls = [call_closure]
+
+def call_builtin(builtin, args, call=call_closure):
+    """Call a builtin with arguments which are already evaluated.
+
+    `call` is how the engine calling the builtin calls a closure. Closures
+    the builtin calls are run that way (see `call_function`).
+
+    The lazy lists among `args` are swapped for cursors in place when the
+    builtin walks them, so the engine should keep no other reference to
+    them while it runs."""
+    if builtin.arity is not None and len(args) != builtin.arity:
+        raise LispError('wrong number of arguments, expected %d got %d'
+                % (builtin.arity, len(args)))
+    if builtin.walks:
+        for i in range(len(args)):
+            if type(args[i]) is LazySeq:
+                args[i] = Cursor(args[i])
+    if engine_calls[-1] is call:
+        return builtin.function(*args)
+    engine_calls.append(call)
+    try:
+        return builtin.function(*args)
+    finally:
+        engine_calls.pop()
+
+def calling_engine():
+    """How the engine calling the current builtin calls a closure."""
+    return engine_calls[-1]
+
+def call_function(function, args, call=None):
+    """Call a function with arguments which are already evaluated.
+
+    This lets builtins call back into Lisp. Closures are run by `call`,
+    by default the engine which called the current builtin."""
+    if call is None:
+        call = engine_calls[-1]
+    if is_builtin(function):
+        return call_builtin(function, args, call)
+    elif not is_closure(function):
+        raise LispError('not a function: %s' % unparse(function))
+    num_params = len(function.params)
+    if len(args) != num_params:
+        raise LispError('wrong number of arguments, expected %d got %d'
+                % (num_params, len(args)))
+    return call(function, args)
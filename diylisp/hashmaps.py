@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+from types import LispError, HashMap, Builtin, Environment
+from ast import is_symbol, is_integer, is_hash_map
+from parser import unparse
+
+"""
+The hash map functions of the language, registered as builtins.
+
+Hash maps are `HashMap` tries, so looking up, adding and removing a key
+take O(log32 n) steps, and an updated map shares all but the changed path
+with the original. Keys are symbols, integers and booleans, and two keys
+are the same if they are `eq`.
+"""
+
+def from_pairs(pairs):
+    hash_map = HashMap()
+    for key, value in pairs:
+        hash_map = hash_map.assoc(key, value)
+    return hash_map
+
+def check_hash_map(hash_map):
+    if not is_hash_map(hash_map):
+        raise LispError('non-hash-map: %s' % unparse(hash_map))
+
+def check_key(key):
+    # Booleans are integers too.
+    if not (is_symbol(key) or is_integer(key)):
+        raise LispError('invalid key: %s' % unparse(key))
+
+def make_hash_map(*args):
+    if len(args) % 2 != 0:
+        raise LispError('hash-map needs a value for every key')
+    keys, values = args[0::2], args[1::2]
+    for key in keys:
+        check_key(key)
+    return from_pairs(zip(keys, values))
+
+def get(hash_map, key):
+    check_hash_map(hash_map)
+    pair = hash_map.find(key)
+    if pair is None:
+        raise LispError('missing key: %s' % unparse(key))
+    return pair[1]
+
+def assoc(hash_map, key, value):
+    check_hash_map(hash_map)
+    check_key(key)
+    return hash_map.assoc(key, value)
+
+def dissoc(hash_map, key):
+    check_hash_map(hash_map)
+    return hash_map.dissoc(key)
+
+def contains(hash_map, key):
+    check_hash_map(hash_map)
+    return hash_map.find(key) is not None
+
+def count(hash_map):
+    check_hash_map(hash_map)
+    return hash_map.count
+
+builtins = {
+        'hash-map' : Builtin('hash-map', None, make_hash_map),
+        'get' : Builtin('get', 2, get),
+        'assoc' : Builtin('assoc', 3, assoc),
+        'dissoc' : Builtin('dissoc', 2, dissoc),
+        'contains?' : Builtin('contains?', 2, contains),
+        'count' : Builtin('count', 1, count)
+        }
+
+Environment.builtins.update(builtins)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from cStringIO import StringIO
+import cPickle
+
+from types import LispError, Environment, saving_cells
+from ast import is_builtin
+from natives import pipeline
+
+"""
+Images, which save an environment to a file to be loaded again later.
+
+Loading the standard library and other Lisp files into a fresh environment
+means parsing and evaluating each of them. Loading an image of the result
+instead brings back all the variables at once, along with the closures and
+the environments they captured.
+
+An image is a pickle of the environment, so values shared between
+variables are still shared after loading, and closures defined in an
+environment still refer to that very environment. Builtins are saved by
+name, and refer to the builtins of the interpreter loading the image.
+Compiled code is left out, and made again when needed. Lists are saved a
+cell at a time without nesting, however long they are. Library definitions
+not evaluated yet are evaluated before saving.
+
+Promises and lazy lists that haven't been computed yet can't be saved,
+and neither can builtins made outside the interpreter.
+"""
+
+magic = 'DIYIMG1\n'
+
+def save_image(env, filename):
+    """Save an environment to an image file.
+
+    Nothing is written if some value can't be saved."""
+    env.load_libraries()
+    data = StringIO()
+    pickler = cPickle.Pickler(data, cPickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistent_id
+    saving_cells.clear()
+    try:
+        pickler.dump(env)
+    except (cPickle.PicklingError, TypeError), e:
+        raise LispError('cannot save in an image: %s' % e)
+    except RuntimeError:
+        raise LispError('cannot save in an image: nested too deeply')
+    finally:
+        saving_cells.clear()
+    with open(filename, 'wb') as imagefile:
+        imagefile.write(magic)
+        imagefile.write(data.getvalue())
+
+def load_image(filename):
+    """Load the environment saved in an image file."""
+    with open(filename, 'rb') as imagefile:
+        if imagefile.read(len(magic)) != magic:
+            raise LispError('not an image: %s' % filename)
+        unpickler = cPickle.Unpickler(imagefile)
+        unpickler.persistent_load = persistent_load
+        try:
+            env = unpickler.load()
+        except (cPickle.UnpicklingError, EOFError, ValueError, TypeError,
+                AttributeError, ImportError, IndexError, KeyError):
+            raise LispError('damaged image: %s' % filename)
+    if not isinstance(env, Environment):
+        raise LispError('damaged image: %s' % filename)
+    return env
+
+def persistent_id(value):
+    if not is_builtin(value):
+        return None
+    elif Environment.builtins.get(value.name) is value:
+        return 'builtin ' + value.name
+    elif value.name == 'pipeline':
+        return 'pipeline ' + ' '.join(value.names)
+    raise LispError('cannot save in an image: %s' % value)
+
+def persistent_load(id):
+    kind, _, names = id.partition(' ')
+    if kind == 'builtin' and names in Environment.builtins:
+        return Environment.builtins[names]
+    elif kind == 'pipeline':
+        return pipeline(names.split(' '))
+    raise cPickle.UnpicklingError('unknown builtin: %s' % id)
@@ -1,36 +1,173 @@
 # -*- coding: utf-8 -*-
 
+from collections import deque
+from os import fstat, stat
 from os.path import dirname, join
 
 from evaluator import evaluate
-from parser import parse, unparse, parse_multiple
-from types import Environment
+import analyzer
+import continuations
+import optimizer
+import vm
+from parser import parse, unparse, read_forms, read_mapped_forms
+from cache import cached_forms
+from types import Environment, LispError
+from ast import is_list, is_symbol
 
-def interpret(source, env=None):
+# The engines that can run a program. Each takes an AST and an environment
+# and returns the value of the AST. `evaluate` is the reference implementation.
+engines = {
+        'evaluate' : evaluate,
+        'analyze' : analyzer.execute,
+        'vm' : vm.execute,
+        'continuations' : continuations.execute
+        }
+
+def interpret(source, env=None, engine='evaluate', optimize=True):
     """
     Interpret a lisp program statement
 
     Accepts a program statement as a string, interprets it, and then
-    returns the resulting lisp expression as string.
+    returns the resulting lisp expression as string. Unless `optimize`
+    is false, the program is passed through the optimizer first.
     """
     if env is None:
         env = Environment()
 
-    return unparse(evaluate(parse(source), env))
+    ast = parse(source)
+    if optimize:
+        ast = optimizer.optimize(ast, env)
+    return unparse(engines[engine](ast, env))
+
+# Files of at least this many bytes are parsed from a memory map. Smaller
+# files are read a chunk at a time, and their expressions let go of once
+# they have been evaluated.
+mmap_threshold = 1 << 20
+
+# Files of at most this many bytes are read in one go instead, and their
+# expressions cached (see `cache.py`). The cache is written from a list
+# of all of them.
+cache_threshold = 1 << 16
 
-def interpret_file(filename, env=None):
+def interpret_file(filename, env=None, engine='evaluate', optimize=True):
     """
     Interpret a lisp file
 
     Accepts the name of a lisp file containing a series of statements. 
-    Returns the value of the last expression of the file.
+    Returns the value of the last expression of the file. Each statement
+    is evaluated as soon as it has been read, before the next one is.
     """
     if env is None:
         env = Environment()
+    run = engines[engine]
+
+    result = ""
+    with open(filename, 'r') as sourcefile:
+        for ast in file_forms(filename, sourcefile):
+            if optimize:
+                ast = optimizer.optimize(ast, env)
+            result = run(ast, env)
+    return unparse(result)
+
+def file_forms(filename, sourcefile):
+    """The expressions of an open file, read from a memory map if the file
+    is large, from the cache if it is small, and a chunk at a time
+    otherwise."""
+    size = fstat(sourcefile.fileno()).st_size
+    if size >= mmap_threshold:
+        return read_mapped_forms(sourcefile)
+    elif size > cache_threshold:
+        return read_forms(sourcefile)
+    return cached_forms(filename, sourcefile.read())
+
+# The indexes made by `library_index`, by file name, along with the size
+# and modification time of the file each was made from.
+library_indexes = {}
+
+def library_index(filename):
+    """
+    Index the top-level definitions of a library file
+
+    Returns a list of the `define` expressions of the file, and a list of
+    its other expressions, both in the order of the file. The index of a
+    file is made once, and made again only if the file changes.
+    """
+    info = stat(filename)
+    version = (info.st_size, info.st_mtime)
+    entry = library_indexes.get(filename)
+    if entry is not None and entry[0] == version:
+        return entry[1]
 
+    definitions, names, others = [], set(), []
     with open(filename, 'r') as sourcefile:
-        source = "".join(sourcefile.readlines())
+        for ast in file_forms(filename, sourcefile):
+            if is_list(ast) and len(ast) == 3 and ast[0] == 'define' \
+                    and is_symbol(ast[1]):
+                if ast[1] in names:
+                    raise LispError('already defined: %s' % ast[1])
+                names.add(ast[1])
+                definitions.append(ast)
+            else:
+                others.append(ast)
+    index = definitions, others
+    library_indexes[filename] = (version, index)
+    return index
 
-    asts = parse_multiple(source)
-    results = [evaluate(ast, env) for ast in asts]
-    return unparse(results[-1])
+def load_library(filename, env, engine='evaluate', optimize=True):
+    """
+    Load a library file into an environment, evaluating each definition
+    only when it is first needed
+
+    The definitions of the file are added to the library of `env`. The
+    first time one of their names is looked up, the definitions not
+    evaluated yet are evaluated in the order of the file, up to the one
+    of that name. The definitions each one uses have then mostly been
+    evaluated already, so looking them up doesn't nest however long the
+    file is. The other expressions of the file are evaluated right away.
+    """
+    run = engines[engine]
+    definitions, others = library_index(filename)
+    for ast in definitions:
+        if env.binds(ast[1]):
+            raise LispError('already defined: %s' % ast[1])
+    if env.library is None:
+        env.library = {}
+    load = loader(definitions, env, run, optimize)
+    for ast in definitions:
+        env.hide_builtin(ast[1])
+        env.library[ast[1]] = load
+    for ast in others:
+        if optimize:
+            ast = optimizer.optimize(ast, env)
+        run(ast, env)
+
+def loader(definitions, env, run, optimize):
+    """The function evaluating the definitions of a library, see
+    `load_library`."""
+    pending = deque(definitions)
+
+    def load(symbol):
+        while symbol in env.library:
+            ast = pending.popleft()
+            # A definition may have been evaluated already, when looking up
+            # a name defined further on had to evaluate it first.
+            if env.library.get(ast[1]) is not load:
+                continue
+            del env.library[ast[1]]
+            run(optimizer.optimize(ast, env) if optimize else ast, env)
+    return load
+
+stdlib_path = join(dirname(__file__), '..', 'stdlib.diy')
+stdlib_lists_path = join(dirname(__file__), '..', 'stdlib-lists.diy')
+
+def load_stdlib(env, engine='evaluate', reference=False):
+    """
+    Load the standard library into an environment
+
+    Each definition is evaluated when it is first needed, see
+    `load_library`. The list functions are builtins. If `reference` is
+    true, the Lisp versions of them are loaded too, hiding the builtins.
+    """
+    load_library(stdlib_path, env, engine)
+    if reference:
+        load_library(stdlib_lists_path, env, engine)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+from itertools import imap, repeat
+import operator
+
+from types import LispError, Builtin, Environment
+from ast import is_integer, is_list, is_ivec
+from parser import unparse
+
+"""
+Numeric vectors, for programs doing the same math on many integers.
+
+An ivec is a Python `array` of machine integers. The math operators work
+on ivecs element by element, with an integer on the other side applying to
+every element. The loops over the elements happen in C, so a single `+` on
+two ivecs is much faster than adding up the elements of two lists one at a
+time in Lisp.
+
+Like other vectors, ivecs are never changed. Elements must fit in a
+machine integer, unlike ordinary integers. The functions making and reducing
+ivecs are registered as builtins.
+"""
+
+TYPECODE = 'l'
+
+def make_ivec(values):
+    try:
+        return array(TYPECODE, values)
+    except OverflowError:
+        raise LispError('Integer too large for an ivec.')
+
+def elementwise(op, a, b):
+    if is_ivec(a) and is_ivec(b):
+        if len(a) != len(b):
+            raise LispError('ivecs of different lengths: %d and %d'
+                    % (len(a), len(b)))
+        return make_ivec(imap(op, a, b))
+    elif is_ivec(a):
+        return make_ivec(imap(op, a, repeat(b)))
+    return make_ivec(imap(op, repeat(a), b))
+
+def ivec_math(op, args):
+    """Do math on arguments which are not all integers.
+
+    This is where the engines end up when a math operator is given
+    anything but integers, so the ordinary case stays fast."""
+    if not all(is_integer(x) or is_ivec(x) for x in args):
+        raise LispError('Arguments must be integers.')
+    def combine(a, b):
+        if is_ivec(a) or is_ivec(b):
+            return elementwise(op, a, b)
+        return op(a, b)
+    return reduce(combine, args)
+
+def check_ivec(ivec):
+    if not is_ivec(ivec):
+        raise LispError('non-ivec: %s' % unparse(ivec))
+
+def check_integers(values):
+    if not all(is_integer(x) for x in values):
+        raise LispError('Arguments must be integers.')
+
+def ivec(*values):
+    check_integers(values)
+    return make_ivec(values)
+
+def irange(start, end):
+    check_integers([start, end])
+    return make_ivec(xrange(start, end))
+
+def vsum(ivec):
+    check_ivec(ivec)
+    return sum(ivec)
+
+def vmax(ivec):
+    check_ivec(ivec)
+    if len(ivec) == 0:
+        raise LispError('empty ivec')
+    return max(ivec)
+
+def vdot(a, b):
+    check_ivec(a)
+    check_ivec(b)
+    if len(a) != len(b):
+        raise LispError('ivecs of different lengths: %d and %d' % (len(a), len(b)))
+    return sum(imap(operator.mul, a, b))
+
+def list_to_ivec(lst):
+    if not is_list(lst):
+        raise LispError('non-list: %s' % unparse(lst))
+    values = list(lst)
+    check_integers(values)
+    return make_ivec(values)
+
+def ivec_to_list(ivec):
+    check_ivec(ivec)
+    return ivec.tolist()
+
+builtins = {
+        'ivec' : Builtin('ivec', None, ivec),
+        'irange' : Builtin('irange', 2, irange),
+        'vsum' : Builtin('vsum', 1, vsum),
+        'vmax' : Builtin('vmax', 1, vmax),
+        'vdot' : Builtin('vdot', 2, vdot),
+        'list->ivec' : Builtin('list->ivec', 1, list_to_ivec),
+        'ivec->list' : Builtin('ivec->list', 1, ivec_to_list)
+        }
+
+Environment.builtins.update(builtins)
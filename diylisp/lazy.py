@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+from types import LispError, Builtin, Environment, LazySeq
+from ast import is_list, is_integer, is_boolean, is_promise
+from parser import unparse
+from evaluator import call_function, calling_engine
+from lists import uncons
+
+"""
+Lazy lists, whose elements are computed when they are needed.
+
+`(delay exp)` is a special form giving a promise of the value of `exp`,
+which `force` evaluates the first time and remembers. `lazy-cons` builds a
+lazy list from a first element and a promise of the rest. `lazy-map`,
+`lazy-filter`, `take`, `iterate` and `range` build lazy lists from other
+lists, or from nothing at all. Lazy lists work with `head`, `tail` and
+`empty` like any other list.
+
+None of these functions walk their list argument, so a pipeline like
+
+    (sum (lazy-filter odd? (lazy-map sq (range 1 1000000))))
+
+computes the elements one at a time as `sum` asks for them, without making
+the intermediate lists first. Each element is computed once, and kept for
+as long as the list is.
+"""
+
+def check_list(lst):
+    if not is_list(lst):
+        raise LispError('non-list: %s' % unparse(lst))
+
+def check_integer(value):
+    if not is_integer(value) or is_boolean(value):
+        raise LispError('Arguments must be integers.')
+
+def force(value):
+    """The value of a promise. Anything else is given back as it is."""
+    if is_promise(value):
+        return value.force()
+    return value
+
+def lazy_cons(first, rest):
+    """A lazy list of `first` followed by `rest`, a list or a promise of
+    one. The promise is forced when the rest is looked at."""
+    if not is_promise(rest):
+        check_list(rest)
+        return LazySeq(lambda: (first, rest))
+    def step():
+        value = rest.force()
+        check_list(value)
+        return uncons(value)
+    return LazySeq(lambda: (first, LazySeq(step)))
+
+# The functions given to `lazy-map`, `lazy-filter` and `iterate` are called
+# when the elements are computed, which may be after the builtin has
+# returned. They are called by the engine which called the builtin, kept
+# as `call`.
+
+def lazy_map(function, lst, call=None):
+    check_list(lst)
+    call = call or calling_engine()
+    def step():
+        pair = uncons(lst)
+        if pair is None:
+            return None
+        return call_function(function, [pair[0]], call), \
+            lazy_map(function, pair[1], call)
+    return LazySeq(step)
+
+def lazy_filter(predicate, lst, call=None):
+    check_list(lst)
+    call = call or calling_engine()
+    def step():
+        pair = uncons(lst)
+        while pair is not None:
+            if call_function(predicate, [pair[0]], call):
+                return pair[0], lazy_filter(predicate, pair[1], call)
+            pair = uncons(pair[1])
+        return None
+    return LazySeq(step)
+
+def take(n, lst):
+    check_integer(n)
+    check_list(lst)
+    def step():
+        pair = uncons(lst) if n > 0 else None
+        if pair is None:
+            return None
+        return pair[0], take(n - 1, pair[1])
+    return LazySeq(step)
+
+def iterate(function, value):
+    """The infinite list of `value`, `(function value)` and so on."""
+    call = calling_engine()
+    return LazySeq(lambda: iterate_step(function, value, call))
+
+def iterate_step(function, value, call):
+    return value, LazySeq(
+        lambda: iterate_step(function, call_function(function, [value], call), call))
+
+def lazy_range(start, end):
+    """The integers from `start` to `end`, both included."""
+    check_integer(start)
+    check_integer(end)
+    return range_from(start, end)
+
+def range_from(start, end):
+    return LazySeq(lambda: (start, range_from(start + 1, end)) if start <= end else None)
+
+builtins = {
+        'force' : Builtin('force', 1, force),
+        'lazy-cons' : Builtin('lazy-cons', 2, lazy_cons),
+        'lazy-map' : Builtin('lazy-map', 2, lazy_map),
+        'lazy-filter' : Builtin('lazy-filter', 2, lazy_filter),
+        'take' : Builtin('take', 2, take),
+        'iterate' : Builtin('iterate', 2, iterate),
+        'range' : Builtin('range', 2, lazy_range)
+        }
+
+Environment.builtins.update(builtins)
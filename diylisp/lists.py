@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+from types import LispError, Cons, ListView, LazySeq
+from ast import is_list
+from parser import unparse
+
+"""
+The list operations of the language, shared by all the engines.
+
+Lists built by the program are chains of `Cons` cells, so `cons`, `head`,
+`tail` and `empty` take constant time. Quoted lists, and lists handed to the
+interpreter from Python, are plain Python lists. The tail of one of those is
+a `ListView` sharing the elements, so walking it is cheap as well. Lazy
+lists are `LazySeq` cells, computed the first time they are looked at.
+"""
+
+def cons(head, tail):
+    if not is_list(tail):
+        raise LispError('non-list: %s' % unparse(tail))
+    return Cons(head, tail)
+
+def head(lst):
+    kind = type(lst)
+    if kind is Cons:
+        return lst.head
+    elif kind is LazySeq:
+        pair = lst.realize()
+        if pair is None:
+            raise LispError('empty list')
+        return pair[0]
+    elif kind is ListView:
+        if lst.start >= len(lst.items):
+            raise LispError('empty list')
+        return lst.items[lst.start]
+    if len(lst) == 0:
+        raise LispError('empty list')
+    return lst[0]
+
+def tail(lst):
+    kind = type(lst)
+    if kind is Cons:
+        return lst.tail
+    elif kind is LazySeq:
+        pair = lst.realize()
+        return lst if pair is None else pair[1]
+    elif kind is ListView:
+        return ListView(lst.items, lst.start + 1) if len(lst) else lst
+    return ListView(lst, 1) if len(lst) else lst
+
+def is_empty(lst):
+    kind = type(lst)
+    if kind is LazySeq:
+        return lst.realize() is None
+    return kind is not Cons and len(lst) == 0
+
+def uncons(lst):
+    """The first element and the rest of a list, or None if it is empty."""
+    if type(lst) is LazySeq:
+        return lst.realize()
+    elif is_empty(lst):
+        return None
+    return head(lst), tail(lst)
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+from itertools import compress, islice
+
+from types import LispError, Builtin, Cons, ListView, Environment, Cursor
+from ast import is_list, is_integer, is_boolean, is_symbol, is_closure
+from parser import unparse
+from evaluator import call_function, math_operators
+from ivecs import ivec_math, make_ivec
+
+"""
+Python versions of the list functions from the standard library.
+
+The Lisp versions recurse once per element, outside of tail position, so
+they run out of Python stack on long lists. These loop instead, and take
+linear time on any kind of list. When `map` and `filter` are given a lambda
+doing nothing but integer math on its parameter, and a list of integers,
+the math is done on all the elements at once instead (see `vectorize`).
+The optimizer turns nested calls to them into a single loop over the
+innermost list (see `pipeline`).
+
+The functions are registered as builtins, which every environment sees.
+Loading `stdlib-lists.diy` defines the Lisp versions on top of them, for
+reference.
+"""
+
+def check_list(lst):
+    # Lazy lists given to the builtins walking them come as cursors.
+    if not is_list(lst) and type(lst) is not Cursor:
+        raise LispError('non-list: %s' % unparse(lst))
+
+def native_sum(lst):
+    check_list(lst)
+    return add_up(lst)
+
+def add_up(elements):
+    total = 0
+    for x in elements:
+        if not is_integer(x):
+            raise LispError('Arguments must be integers.')
+        total += x
+    return total
+
+def native_length(lst):
+    check_list(lst)
+    if isinstance(lst, (list, ListView)):
+        return len(lst)
+    n = 0
+    for _ in lst:
+        n += 1
+    return n
+
+def native_append(left, right):
+    check_list(left)
+    check_list(right)
+    result = right
+    for x in reversed(list(left)):
+        result = Cons(x, result)
+    return result
+
+def native_filter(predicate, lst):
+    check_list(lst)
+    vectorized = vectorize(predicate, lst)
+    if vectorized is not None:
+        values, results = vectorized
+        return list(compress(values, results))
+    return [x for x in lst if call_function(predicate, [x])]
+
+def native_map(function, lst):
+    check_list(lst)
+    vectorized = vectorize(function, lst)
+    if vectorized is not None:
+        return vectorized[1]
+    return [call_function(function, [x]) for x in lst]
+
+def vectorize(function, lst):
+    """Apply a function to all the elements of a list at once.
+
+    This works if the function is a lambda of one parameter whose body is
+    made of nothing but the parameter, integers and math operators, and
+    the elements are all integers. Its body is then evaluated once, with
+    the parameter standing for an ivec of all the elements, which runs the
+    loops over the elements in C. Returns the elements and the results in
+    lists, or None if the function must be called for each element."""
+    lowered = lowering(function)
+    if lowered is None:
+        return None
+    values = list(lst)
+    if not all(type(x) is int for x in values):
+        return None
+    compute, gives_booleans = lowered
+    try:
+        results = compute(make_ivec(values))
+    except LispError:
+        # Some number is too large for an ivec.
+        return None
+    if is_integer(results):
+        results = [results] * len(values)
+    elif gives_booleans:
+        results = [bool(x) for x in results]
+    else:
+        results = results.tolist()
+    return values, results
+
+def lowering(function):
+    """What `lower` makes of the body of a function of one parameter."""
+    if not is_closure(function) or len(function.params) != 1:
+        return None
+    return lower(function.body, function.params[0])
+
+def lower(ast, param):
+    """Turn integer math on `param` into a function of an ivec, and whether
+    evaluating the math gives booleans. Returns None for anything else."""
+    if is_symbol(ast) and ast == param:
+        return (lambda xs: xs), False
+    elif is_integer(ast) and not is_boolean(ast):
+        return (lambda xs: ast), False
+    elif not is_list(ast) or len(ast) < 2 or not is_symbol(ast[0]) \
+            or ast[0] not in math_operators:
+        return None
+    parts = [lower(x, param) for x in ast[1:]]
+    if None in parts:
+        return None
+    op = math_operators[ast[0]]
+    computes = [compute for compute, _ in parts]
+    if len(parts) == 1:
+        # A single argument is given back as it is.
+        gives_booleans = parts[0][1]
+    else:
+        gives_booleans = ast[0] == '>'
+    return (lambda xs: ivec_math(op, [compute(xs) for compute in computes])), \
+        gives_booleans
+
+def pipeline(names):
+    """A builtin doing the work of nested calls to the list builtins.
+
+    `names` are the builtins called, from the outermost in, like `sum`,
+    `map` and `filter` for `(sum (map f (filter p xs)))`. Its arguments are
+    the values the calls would evaluate, in the same order: the value of
+    each name, followed by the function given to it for `map` and
+    `filter`, and finally the innermost list.
+
+    When the names still stand for the builtins, the list is taken a chunk
+    at a time, and each chunk goes through all the calls before the next
+    one is looked at. No list longer than a chunk is made in between, and
+    `map` and `filter` can still vectorize their work on each chunk.
+    Otherwise the calls are made as written."""
+    def run(*values):
+        calls = []
+        position = 0
+        for name in names:
+            function = values[position]
+            if name in ('map', 'filter'):
+                calls.append((name, function, values[position + 1]))
+                position += 2
+            else:
+                calls.append((name, function, None))
+                position += 1
+        source = values[-1]
+        if any(function is not builtins[name] for name, function, _ in calls):
+            result = source.rest if type(source) is Cursor else source
+            for name, function, arg in reversed(calls):
+                args = [result] if arg is None else [arg, result]
+                result = call_function(function, args)
+            return result
+        return fused(calls, source)
+    arity = len(names) + names.count('map') + names.count('filter') + 1
+    builtin = Builtin('pipeline', arity, run, walks=True)
+    builtin.names = names
+    return builtin
+
+# How many elements a pipeline takes from its list at a time.
+chunk_size = 4096
+
+def fused(calls, source):
+    check_list(source)
+    elements = iter(source)
+    total, results = 0, []
+    while True:
+        chunk = list(islice(elements, chunk_size))
+        if not chunk:
+            break
+        for name, _, function in reversed(calls):
+            if name == 'map':
+                chunk = native_map(function, chunk)
+            elif name == 'filter':
+                chunk = native_filter(function, chunk)
+        if calls[0][0] == 'sum':
+            total += add_up(chunk)
+        elif calls[0][0] == 'length':
+            total += len(chunk)
+        else:
+            results.extend(chunk)
+    return results if calls[0][0] in ('map', 'filter') else total
+
+builtins = {
+        'sum' : Builtin('sum', 1, native_sum, walks=True),
+        'length' : Builtin('length', 1, native_length, walks=True),
+        'append' : Builtin('append', 2, native_append),
+        'filter' : Builtin('filter', 2, native_filter),
+        'map' : Builtin('map', 2, native_map)
+        }
+
+Environment.builtins.update(builtins)
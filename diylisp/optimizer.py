@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+
+from types import LispError, Environment
+from ast import is_boolean, is_symbol, is_list, is_integer, is_closure, is_builtin
+from evaluator import math_operators, keywords, eval_math
+from natives import builtins, pipeline
+
+"""
+This is the Optimizer module. It rewrites ASTs between parsing and evaluation,
+doing ahead of time the work that gives the same result every time:
+
+ - Math on constant arguments, like `(+ 1 (* 2 3))`, is computed.
+ - An `if` whose condition is constant is replaced by the branch taken.
+ - Quoted integers and booleans are replaced by the plain value.
+ - Variables already defined as integers or booleans are replaced by their
+   value. This is safe because variables can't be redefined. Parameters of
+   an enclosing lambda are left alone, as they may shadow the definition.
+ - Calls to small, already defined closures, like `not` or `<=` from the
+   stdlib, are replaced by the body of the closure. See `inline_call`.
+ - Nested calls to the list builtins, like `(sum (map f (filter p xs)))`,
+   are replaced by a single call doing the work in one loop, when calling
+   `f` and `p` can neither fail nor have any effect. See `fuse`.
+
+Anything the optimizer can't be sure about, including malformed forms and
+expressions which would raise an error, is left for the evaluator. The
+optimized AST is a new one; the original is never changed.
+"""
+
+# Closures with bodies of at most this many nodes are inlined.
+inline_size = 16
+
+# How many inlined calls may be nested inside each other. This stops the
+# inlining of recursive functions.
+inline_depth = 4
+
+def optimize(ast, env=None, inline=True):
+    """Return an AST equivalent to `ast` when evaluated in `env`."""
+    return fold(ast, env, frozenset(), inline_depth if inline else 0)
+
+def is_constant(ast):
+    return is_boolean(ast) or is_integer(ast)
+
+def is_special(symbol):
+    return is_symbol(symbol) and (symbol in keywords or symbol in math_operators)
+
+def fold(ast, env, params, depth):
+    """Optimize an AST.
+
+    `params` are the parameters of enclosing lambdas, and `depth` is how
+    many more levels of calls may be inlined."""
+    if is_symbol(ast):
+        return fold_variable(ast, env, params)
+    elif not is_list(ast) or len(ast) == 0:
+        return ast
+
+    head = ast[0]
+    if head == 'quote':
+        if len(ast) == 2 and is_constant(ast[1]):
+            return ast[1]
+        return ast
+    elif head == 'lambda':
+        if len(ast) != 3 or not is_list(ast[1]):
+            return ast
+        inner = params.union(x for x in ast[1] if is_symbol(x))
+        return ['lambda', ast[1], fold(ast[2], env, inner, depth)]
+    elif head == 'define':
+        if len(ast) != 3:
+            return ast
+        return ['define', ast[1], fold(ast[2], env, params, depth)]
+    elif head == 'if':
+        if len(ast) != 4:
+            return ast
+        predicate = fold(ast[1], env, params, depth)
+        if is_constant(predicate):
+            return fold(ast[2] if predicate else ast[3], env, params, depth)
+        return ['if', predicate] + [fold(x, env, params, depth) for x in ast[2:]]
+    elif is_symbol(head) and head in math_operators:
+        return fold_math(ast, env, params, depth)
+    elif is_symbol(head) and head in keywords:
+        return [head] + [fold(x, env, params, depth) for x in ast[1:]]
+    fused = fuse(ast, env, params, depth)
+    if fused is not None:
+        return fused
+    return inline_call([fold(x, env, params, depth) for x in ast],
+                       env, params, depth)
+
+def fold_variable(symbol, env, params):
+    if env is None or symbol in params:
+        return symbol
+    try:
+        value = env.lookup(symbol)
+    except LispError:
+        return symbol
+    return value if is_constant(value) else symbol
+
+def fold_math(ast, env, params, depth):
+    folded = [ast[0]] + [fold(x, env, params, depth) for x in ast[1:]]
+    if len(folded) < 2 or not all(is_constant(x) for x in folded[1:]):
+        return folded
+    try:
+        value = eval_math(folded, Environment())
+    except (LispError, ArithmeticError):
+        return folded
+    return value if is_constant(value) else folded
+
+##
+## Fusion of nested calls to the list builtins.
+##
+
+# The builtins taking a function before the list.
+list_transforms = ('map', 'filter')
+
+# The builtins giving something other than a list, which can only come last.
+list_reductions = ('sum', 'length')
+
+def fuse(ast, env, params, depth):
+    """Replace nested calls to the list builtins by a call to a `pipeline`.
+
+    The chain of calls goes from the outermost in, as long as the function
+    called is one of `map`, `filter`, `sum` and `length`, with `sum` and
+    `length` only at the start. Nothing is done for fewer than two calls.
+    The pipeline is given the same expressions to evaluate, in the same
+    order, including the names of the builtins. It checks that these are
+    still the builtins before doing anything different from the calls.
+
+    The pipeline calls the functions given to `map` and `filter` in another
+    order than the nested calls do, so these must be pure (see
+    `calls_purely`). Otherwise which of them fails first, or the order of
+    their effects, could change."""
+    if env is None:
+        return None
+    names, parts = [], []
+    while is_list(ast) and len(ast) > 0 \
+            and is_list_builtin(ast[0], env, params):
+        name = ast[0]
+        if name in list_transforms and len(ast) == 3 \
+                and calls_purely(ast[1], env, params):
+            parts.extend([name, fold(ast[1], env, params, depth)])
+            ast = ast[2]
+        elif name in list_reductions and len(ast) == 2 and not names:
+            parts.append(name)
+            ast = ast[1]
+        else:
+            break
+        names.append(name)
+    if len(names) < 2:
+        return None
+    return [pipeline(names)] + parts + [fold(ast, env, params, depth)]
+
+def is_list_builtin(symbol, env, params):
+    return is_symbol(symbol) and symbol not in params \
+        and symbol in list_transforms + list_reductions \
+        and env.lookup(symbol) is builtins[symbol]
+
+def calls_purely(ast, env, params):
+    """Whether calling the function an AST evaluates to, with one argument,
+    can neither fail nor have any effect. It must be a lambda, or a closure
+    already defined, whose body is pure."""
+    if is_list(ast) and len(ast) == 3 and ast[0] == 'lambda':
+        names, body = ast[1], ast[2]
+    elif is_symbol(ast) and ast not in params:
+        try:
+            closure = env.lookup(ast)
+        except LispError:
+            return False
+        if not is_closure(closure):
+            return False
+        names, body = closure.params, closure.body
+        env, params = closure.env, frozenset()
+    else:
+        return False
+    if not is_list(names) or len(names) != 1 or not is_symbol(names[0]) \
+            or is_special(names[0]):
+        return False
+    return is_pure(body, env, params.union(names))
+
+##
+## Inlining of calls to small closures.
+##
+
+def inline_call(ast, env, params, depth):
+    """Replace a call to a small closure by the body of the closure.
+
+    The closure must already be defined, so that it can't change later. The
+    parameters in its body are replaced by the argument expressions. Since
+    function calls evaluate each argument exactly once, and before the body,
+    an argument can be moved into the body freely only if it is pure. Other
+    arguments are only allowed if the parameter is used once, and is among
+    the first things the body evaluates, in the same order as the arguments.
+
+    Free variables of the body which are builtins might be defined again in
+    a frame between the closure and the call, so such closures are left
+    alone.
+    """
+    head = ast[0]
+    if depth <= 0 or env is None or not is_symbol(head) or head in params:
+        return ast
+    try:
+        closure = env.lookup(head)
+    except LispError:
+        return ast
+    if not (is_closure(closure) and can_inline(closure, env)):
+        return ast
+
+    names, body, args = closure.params, closure.body, ast[1:]
+    if len(names) != len(args):
+        return ast
+    free = free_variables(body, names)
+    if free & params or not all(env.defines(x) for x in free) \
+            or any(finds_builtin(closure.env, x) for x in free):
+        return ast
+    # A special form given as argument is an error to evaluate, but would
+    # be taken for the form in head position.
+    called = heads(body)
+    if any(is_special(arg) and name in called for name, arg in zip(names, args)):
+        return ast
+
+    impure = [name for name, arg in zip(names, args)
+              if not is_pure(arg, env, params)]
+    if impure:
+        if any(count_uses(body, name) != 1 for name in impure):
+            return ast
+        evaluated = [x for x in first_evaluated(body) if x in impure]
+        if evaluated != impure:
+            return ast
+
+    inlined = substitute(body, dict(zip(names, args)))
+    return fold(inlined, env, params, depth - 1)
+
+def can_inline(closure, env):
+    """Whether the body of the closure may be evaluated in `env` instead."""
+    names, body = closure.params, closure.body
+    if not is_list(names) or not all(is_symbol(x) for x in names) \
+            or any(is_special(x) for x in names) \
+            or len(set(names)) != len(names):
+        return False
+    if size(body) > inline_size \
+            or contains_form(body, ('define', 'lambda', 'delay')):
+        return False
+    outer = env
+    while outer is not None and outer is not closure.env:
+        outer = outer.parent
+    return outer is not None
+
+def finds_builtin(env, symbol):
+    """Whether looking up the symbol in `env` gives a builtin."""
+    try:
+        return is_builtin(env.lookup(symbol))
+    except LispError:
+        return False
+
+def heads(ast):
+    """The symbols in head position in an AST without lambdas."""
+    if not is_list(ast) or len(ast) == 0 or ast[0] == 'quote':
+        return set()
+    found = set([ast[0]]) if is_symbol(ast[0]) else set()
+    return found.union(*[heads(x) for x in ast])
+
+def size(ast):
+    if is_list(ast):
+        return 1 + sum(size(x) for x in ast)
+    return 1
+
+def contains_form(ast, names):
+    if not is_list(ast) or len(ast) == 0:
+        return False
+    elif ast[0] in names:
+        return True
+    elif ast[0] == 'quote':
+        return False
+    return any(contains_form(x, names) for x in ast)
+
+def references(ast):
+    """The symbols looked up when evaluating an AST without lambdas."""
+    if is_symbol(ast):
+        return [ast]
+    elif not is_list(ast) or len(ast) == 0 or ast[0] == 'quote':
+        return []
+    start = 1 if is_special(ast[0]) else 0
+    return [symbol for x in ast[start:] for symbol in references(x)]
+
+def free_variables(body, names):
+    return set(references(body)) - set(names)
+
+def count_uses(body, name):
+    return references(body).count(name)
+
+def first_evaluated(ast):
+    """The symbols an AST always evaluates first, in order.
+
+    This stops at the first step which may branch or fail, or do anything
+    but look up a variable or give a constant."""
+    evaluated = []
+
+    def visit(ast):
+        if is_symbol(ast):
+            evaluated.append(ast)
+            return True
+        elif not is_list(ast) or len(ast) == 0 or ast[0] == 'quote':
+            return True
+        elif ast[0] in ('if', 'and', 'or'):
+            if len(ast) > 1:
+                visit(ast[1])
+            return False
+        start = 1 if is_special(ast[0]) else 0
+        for x in ast[start:]:
+            if not visit(x):
+                return False
+        return False
+
+    visit(ast)
+    return evaluated
+
+def is_pure(ast, env, params):
+    """Whether evaluating an AST can neither fail nor have any effect.
+
+    Such expressions may be duplicated or dropped without changing what the
+    program does."""
+    if is_constant(ast):
+        return True
+    elif is_symbol(ast):
+        return ast in params or (not is_special(ast) and env.defines(ast))
+    elif not is_list(ast) or len(ast) == 0:
+        return False
+    elif ast[0] == 'quote':
+        return len(ast) == 2
+    elif ast[0] in ('eq', 'atom', 'if'):
+        arities = {'eq': 3, 'atom': 2, 'if': 4}
+        return len(ast) == arities[ast[0]] \
+            and all(is_pure(x, env, params) for x in ast[1:])
+    return False
+
+def substitute(ast, bindings):
+    """Replace parameters in an AST without lambdas by their arguments."""
+    if is_symbol(ast):
+        return bindings.get(ast, ast)
+    elif not is_list(ast) or len(ast) == 0 or ast[0] == 'quote':
+        return ast
+    start = 1 if is_special(ast[0]) else 0
+    return ast[:start] + [substitute(x, bindings) for x in ast[start:]]
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 
+import mmap
 import re
-from ast import is_boolean, is_list
+from ast import is_boolean, is_list, is_vector, is_hash_map, is_ivec
 from types import LispError
 
 """
@@ -10,33 +11,82 @@ the workshop. It's job is to convert strings into data structures that the evalu
 understand. 
 """
 
+# A token is a paren, a quote, a comment or an atom. Whitespace in between
+# is skipped by `finditer`.
+token_pattern = re.compile(r"[()']|;[^\n]*|[^\s()';]+")
+
+integer_pattern = re.compile(r"-?[0-9]+$")
+
 def parse(source):
     """Parse string representation of one *single* expression
-    into the corresponding Abstract Syntax Tree."""
-
-    ast = remove_comments(source)
-    ast = ast.strip()
-
-    if ast == '#t':
-        ast = True
-    elif ast == '#f':
-        ast = False
-    elif ast.lstrip('-').isdigit():
-        ast = int(ast)
-    elif ast.startswith('('):
-        close_paren = find_matching_paren(ast)
-        if close_paren != len(ast) - 1:
-            raise LispError("Expected EOF")
-        ast = [parse(expr) for expr in split_exps(ast[1:close_paren])]
-    elif ast.startswith('\''):
-        ast = ['quote', parse(ast[1:])]
+    into the corresponding Abstract Syntax Tree.
+
+    The source is read in a single pass over its tokens, see `read`."""
 
+    tokens = token_pattern.finditer(source)
+    ast = read(tokens)
+    if ast is end_of_source:
+        raise LispError("Expected an expression")
+    for match in tokens:
+        if not match.group().startswith(';'):
+            raise LispError("Expected EOF")
     return ast
 
+# What `read` gives when there are no more expressions.
+end_of_source = object()
+
+def read(tokens):
+    """Read the next expression from an iterator over tokens.
+
+    Lists being read are kept on an explicit stack, with `None` standing
+    for a quote waiting for its expression. Each token is looked at once,
+    so this takes linear time, and nesting isn't limited by the Python
+    stack. Returns `end_of_source` if there are no more expressions."""
+
+    stack = []
+    for match in tokens:
+        token = match.group()
+        first = token[0]
+        if first == ';':
+            continue
+        elif first == '(':
+            stack.append((match, []))
+            continue
+        elif first == "'":
+            stack.append((match, None))
+            continue
+        elif first == ')':
+            if not stack or stack[-1][1] is None:
+                raise LispError("Unexpected ')'")
+            ast = stack.pop()[1]
+        else:
+            ast = parse_atom(token)
+
+        while stack and stack[-1][1] is None:
+            stack.pop()
+            ast = ['quote', ast]
+        if not stack:
+            return ast
+        stack[-1][1].append(ast)
+
+    if stack:
+        match = stack[0][0]
+        raise LispError("Incomplete expression: %s"
+                % match.string[match.start():].strip())
+    return end_of_source
+
+def parse_atom(token):
+    if token == '#t':
+        return True
+    elif token == '#f':
+        return False
+    elif integer_pattern.match(token):
+        return int(token)
+    return token
+
 ##
-## Below are a few useful utility functions. These should come in handy when 
-## implementing `parse`. We don't want to spend the day implementing parenthesis 
-## counting, after all.
+## Below are a few useful utility functions. `parse` doesn't need them any
+## more, but the REPL counts parentheses in the lines it reads.
 ## 
 
 def remove_comments(source):
@@ -60,41 +110,6 @@ def find_matching_paren(source, start=0):
             open_brackets -= 1
     return pos
 
-def split_exps(source):
-    """Splits a source string into subexpressions 
-    that can be parsed individually.
-
-    Example: 
-
-        > split_exps("foo bar (baz 123)")
-        ["foo", "bar", "(baz 123)"]
-    """
-
-    rest = source.strip()
-    exps = []
-    while rest:
-        exp, rest = first_expression(rest)
-        exps.append(exp)
-    return exps
-
-def first_expression(source):
-    """Split string into (exp, rest) where exp is the 
-    first expression in the string and rest is the 
-    rest of the string after this expression."""
-    
-    source = source.strip()
-    if source[0] == "'":
-        exp, rest = first_expression(source[1:])
-        return source[0] + exp, rest
-    elif source[0] == "(":
-        last = find_matching_paren(source)
-        return source[:last + 1], source[last + 1:]
-    else:
-        match = re.match(r"^[^\s)']+", source)
-        end = match.end()
-        atom = source[:end]
-        return atom, source[end:]
-
 ##
 ## The functions below, `parse_multiple` and `unparse` are implemented in order for
 ## the REPL to work. Don't worry about them when implementing the language.
@@ -110,8 +125,70 @@ def parse_multiple(source):
 
     """
 
-    source = remove_comments(source)
-    return [parse(exp) for exp in split_exps(source)]
+    return list(parse_forms(source))
+
+def parse_forms(source):
+    """Like `parse_multiple`, but a generator giving each expression as soon
+    as it has been read."""
+    return read_all(token_pattern.finditer(source))
+
+def read_forms(stream):
+    """Read the expressions from a file object, one at a time.
+
+    This is a generator, giving each expression as soon as it has been
+    read. Only the part of the file holding the expression being read is
+    kept in memory."""
+    return read_all(stream_tokens(stream))
+
+def read_mapped_forms(sourcefile):
+    """Like `read_forms`, but for a memory map of a file, which must not be
+    empty.
+
+    The tokens are found by running the regex over the mapped bytes, so
+    the source is never copied into strings. The only objects made are
+    the tokens, and the parens and quotes among them are shared one
+    character strings."""
+    source = mmap.mmap(sourcefile.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        for ast in read_all(token_pattern.finditer(source)):
+            yield ast
+    finally:
+        source.close()
+
+def read_all(tokens):
+    while True:
+        ast = read(tokens)
+        if ast is end_of_source:
+            return
+        yield ast
+
+# How many characters `stream_tokens` reads at a time.
+chunk_size = 1 << 16
+
+def stream_tokens(stream):
+    """The tokens of the source read from a file object, a chunk at a time.
+
+    A token reaching the end of a chunk may go on in the next one, so it is
+    read again together with the next chunk."""
+    rest = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        text = rest + chunk
+        if not chunk:
+            for match in token_pattern.finditer(text):
+                yield match
+            return
+        rest = ''
+        previous = None
+        for match in token_pattern.finditer(text):
+            if previous is not None:
+                yield previous
+            previous = match
+        if previous is not None:
+            if previous.end() == len(text):
+                rest = text[previous.start():]
+            else:
+                yield previous
 
 def unparse(ast):
     """Turns an AST back into lisp program source"""
@@ -119,10 +196,19 @@ def unparse(ast):
     if is_boolean(ast):
         return "#t" if ast else "#f"
     elif is_list(ast):
+        if not isinstance(ast, list):
+            ast = list(ast)
         if len(ast) > 0 and ast[0] == "quote":
             return "'%s" % unparse(ast[1])
         else:
             return "(%s)" % " ".join([unparse(x) for x in ast])
+    elif is_vector(ast):
+        return "#(%s)" % " ".join([unparse(x) for x in ast])
+    elif is_ivec(ast):
+        return "#i(%s)" % " ".join([str(x) for x in ast])
+    elif is_hash_map(ast):
+        pairs = sorted(ast.items(), key=lambda pair: unparse(pair[0]))
+        return "{%s}" % " ".join(["%s %s" % (unparse(k), unparse(v)) for k, v in pairs])
     else:
         # integers or symbols (or lambdas)
         return str(ast)
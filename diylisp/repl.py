@@ -2,11 +2,10 @@
 
 import os
 import sys
-from os.path import dirname, relpath, join
 
 from types import LispError, Environment
 from parser import remove_comments
-from interpreter import interpret, interpret_file
+from interpreter import interpret, load_stdlib
 
 # importing this gives readline goodness when running on systems
 # where it is supported (i.e. UNIX-y systems)
@@ -15,8 +14,11 @@ try:
 except ImportError:
     pass
 
-def repl():
-    """Start the interactive Read-Eval-Print-Loop"""
+def repl(env=None):
+    """Start the interactive Read-Eval-Print-Loop
+
+    Without an environment, the REPL starts from a new one with the
+    standard library loaded."""
     print
     print "                 " + faded("                             \`.    T       ")
     print "    Welcome to   " + faded("   .--------------.___________) \   |    T  ")
@@ -26,11 +28,12 @@ def repl():
     print faded("  use ^D to exit")
     print
 
-    env = Environment()
-    try:
-        interpret_file(join(dirname(relpath(__file__)), '..', 'stdlib.diy'), env)
-    except LispError:
-        pass
+    if env is None:
+        env = Environment()
+        try:
+            load_stdlib(env)
+        except LispError:
+            pass
     while True:
         try:
             source = read_expression()
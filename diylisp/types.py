@@ -1,7 +1,5 @@
 # -*- coding: utf-8 -*-
 
-from itertools import chain
-
 """
 This module holds some types we'll have use for along the way.
 
@@ -23,23 +21,672 @@ class Closure:
     def __str__(self):
         return "<closure/%d>" % len(self.params)
 
-class Environment:
+    def __getstate__(self):
+        # The code compiled by the engines is left out of images.
+        state = self.__dict__.copy()
+        state.pop('code', None)
+        state.pop('proc', None)
+        return state
+
+class Builtin:
+    """A function of the language implemented in Python.
+
+    It is called with the values of its arguments, of which there must be
+    `arity`, or any number if `arity` is None. A builtin which `walks` the
+    lazy lists it is given, without keeping them, is given a `Cursor` in
+    place of each one."""
+
+    walks = False
+
+    def __init__(self, name, arity, function, walks=False):
+        self.name = name
+        self.arity = arity
+        self.function = function
+        self.walks = walks
+
+    def __str__(self):
+        return "<builtin %s>" % self.name
+
+# The list cells to be saved without the cells after them, because these
+# have been saved already. See `later_cells`.
+saving_cells = set()
+
+def later_cells(cell, next_cell):
+    """The cells to save before a list cell, so saving it doesn't nest.
+
+    Saving each cell along with the rest of its list would nest as deep as
+    the list is long. The first cell of a list saved instead gives the
+    cells after it, from the last one back, to be saved first. When these
+    are saved in turn, the rest of each has been saved already, and they
+    give no cells. `next_cell` gives the next cell of the same kind, or
+    None."""
+    if id(cell) in saving_cells:
+        saving_cells.discard(id(cell))
+        return ()
+    later = []
+    cell = next_cell(cell)
+    while cell is not None:
+        later.append(cell)
+        cell = next_cell(cell)
+    later.reverse()
+    saving_cells.update(id(x) for x in later)
+    return later
+
+class Cons(object):
+    """An immutable list cell, holding the first element and the rest.
+
+    The rest is either another cell or any other kind of list, where an
+    empty list ends the list. Lisp code can't tell cells from Python lists,
+    and neither can `==`."""
+
+    __slots__ = ('head', 'tail')
+
+    def __init__(self, head, tail):
+        self.head = head
+        self.tail = tail
+
+    def next_cell(self):
+        return self.tail if type(self.tail) is Cons else None
+
+    def __reduce__(self):
+        return Cons, (None, None), (later_cells(self, Cons.next_cell), self.head, self.tail)
+
+    def __setstate__(self, state):
+        _, self.head, self.tail = state
+
+    def __iter__(self):
+        cell = self
+        while type(cell) is Cons:
+            yield cell.head
+            cell = cell.tail
+        for x in cell:
+            yield x
+
+    def __eq__(self, other):
+        if not isinstance(other, (Cons, ListView, LazySeq, list)):
+            return False
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+class ListView(object):
+    """The elements of a Python list from `start` on, without copying them.
+
+    The list must not be changed while views of it are in use."""
+
+    __slots__ = ('items', 'start')
+
+    def __init__(self, items, start):
+        self.items = items
+        self.start = start
+
+    def __len__(self):
+        return max(len(self.items) - self.start, 0)
+
+    def __reduce__(self):
+        # The whole Python list is saved, once for all the views of it.
+        return ListView, (self.items, self.start)
+
+    def __iter__(self):
+        items = self.items
+        for i in xrange(self.start, len(items)):
+            yield items[i]
+
+    def __eq__(self, other):
+        if not isinstance(other, (Cons, ListView, LazySeq, list)):
+            return False
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+class LazySeq(object):
+    """A list whose elements are computed when they are needed.
+
+    `step` gives None if the list is empty, or else a pair of the first
+    element and the rest, which may be any kind of list. The first time
+    `realize` is called the pair is kept, so each cell is stepped once
+    however the list is walked."""
+
+    __slots__ = ('step', 'pair')
+
+    def __init__(self, step):
+        self.step = step
+        self.pair = None
+
+    def realize(self):
+        if self.step is not None:
+            pair = self.step()
+            # Like forcing a promise, the first pair wins.
+            if self.step is not None:
+                self.pair, self.step = pair, None
+        return self.pair
+
+    def next_cell(self):
+        if self.step is not None or self.pair is None \
+                or type(self.pair[1]) is not LazySeq:
+            return None
+        return self.pair[1]
+
+    def __reduce__(self):
+        # The first cell not computed yet may be among the later cells of
+        # a list, and fails when it is saved in turn.
+        if self.step is not None:
+            raise LispError('cannot save a lazy list before it is computed')
+        return LazySeq, (None,), (later_cells(self, LazySeq.next_cell), self.pair)
+
+    def __setstate__(self, state):
+        _, self.pair = state
+
+    def __iter__(self):
+        lst = self
+        while type(lst) is LazySeq:
+            pair = lst.realize()
+            if pair is None:
+                return
+            yield pair[0]
+            lst = pair[1]
+        for x in lst:
+            yield x
+
+    def __eq__(self, other):
+        if not isinstance(other, (Cons, ListView, LazySeq, list)):
+            return False
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+class Cursor(object):
+    """A place in a lazy list, which moves on as the list is walked.
+
+    The caller of a builtin holds on to its arguments until it returns, and
+    with them every cell computed since the first. Given a cursor instead,
+    the builtin only keeps the cells it hasn't walked past."""
+
+    __slots__ = ('rest',)
+
+    def __init__(self, rest):
+        self.rest = rest
+
+    def __iter__(self):
+        while type(self.rest) is LazySeq:
+            pair = self.rest.realize()
+            if pair is None:
+                return
+            self.rest = pair[1]
+            yield pair[0]
+        rest, self.rest = self.rest, []
+        for x in rest:
+            yield x
+
+class Promise(object):
+    """The value of an expression, computed by `thunk` when first forced."""
+
+    __slots__ = ('thunk', 'value')
+
+    def __init__(self, thunk):
+        self.thunk = thunk
+        self.value = None
+
+    def force(self):
+        if self.thunk is not None:
+            value = self.thunk()
+            # Forcing the promise again from within the thunk may have
+            # set the value already. The first value wins.
+            if self.thunk is not None:
+                self.value, self.thunk = value, None
+        return self.value
+
+    def __getstate__(self):
+        if self.thunk is not None:
+            raise LispError('cannot save a promise before it is forced')
+        return None, {'thunk': None, 'value': self.value}
+
+    def __str__(self):
+        return "<promise>"
+
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+
+class Vector(object):
+    """An immutable vector, giving indexed access to a sequence of values.
+
+    The vector is a trie with 32 branches per node. The elements are kept
+    in the leaves, in order, and an index is split into groups of five bits
+    choosing the branch to take at each level. Reaching any element thus
+    takes at most log32(n) steps.
+
+    Setting an element copies only the nodes on the path to it, and shares
+    all the others with the original vector. To make adding elements at the
+    end cheap, the last (up to 32) elements are kept in a separate `tail`
+    node, which is moved into the trie once it is full."""
+
+    __slots__ = ('count', 'shift', 'root', 'tail')
+
+    def __init__(self, count=0, shift=BITS, root=(), tail=()):
+        self.count = count
+        self.shift = shift
+        self.root = root
+        self.tail = tail
+
+    def tail_offset(self):
+        """The index of the first element kept in the tail."""
+        if self.count < WIDTH:
+            return 0
+        return ((self.count - 1) >> BITS) << BITS
+
+    def leaf(self, index):
+        """The node holding the element with the specified index."""
+        if index >= self.tail_offset():
+            return self.tail
+        node = self.root
+        level = self.shift
+        while level > 0:
+            node = node[(index >> level) & MASK]
+            level -= BITS
+        return node
 
-    def __init__(self, variables=None):
+    def nth(self, index):
+        return self.leaf(index)[index & MASK]
+
+    def assoc(self, index, value):
+        """A vector with the element at `index` replaced by `value`."""
+        if index >= self.tail_offset():
+            tail = list(self.tail)
+            tail[index & MASK] = value
+            return Vector(self.count, self.shift, self.root, tuple(tail))
+        return Vector(self.count, self.shift,
+                      assoc_path(self.shift, self.root, index, value), self.tail)
+
+    def push(self, value):
+        """A vector with `value` added at the end."""
+        if self.count - self.tail_offset() < WIDTH:
+            return Vector(self.count + 1, self.shift, self.root,
+                          self.tail + (value,))
+        shift = self.shift
+        if (self.count >> BITS) > (1 << shift):
+            # The trie is full, so it gets another level.
+            root = (self.root, new_path(shift, self.tail))
+            shift += BITS
+        else:
+            root = push_tail(self.count, shift, self.root, self.tail)
+        return Vector(self.count + 1, shift, root, (value,))
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for start in xrange(0, self.count, WIDTH):
+            for value in self.leaf(start):
+                yield value
+
+    def __eq__(self, other):
+        return isinstance(other, Vector) and self.count == other.count \
+            and list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "Vector(%r)" % list(self)
+
+def assoc_path(level, node, index, value):
+    node = list(node)
+    if level == 0:
+        node[index & MASK] = value
+    else:
+        i = (index >> level) & MASK
+        node[i] = assoc_path(level - BITS, node[i], index, value)
+    return tuple(node)
+
+def new_path(level, leaf):
+    """A branch of the trie holding nothing but the leaf."""
+    node = leaf
+    while level > 0:
+        node = (node,)
+        level -= BITS
+    return node
+
+def push_tail(count, level, parent, leaf):
+    """Copy the path to the end of the trie, adding the leaf there."""
+    i = ((count - 1) >> level) & MASK
+    if level == BITS:
+        child = leaf
+    elif i < len(parent):
+        child = push_tail(count, level - BITS, parent[i], leaf)
+    else:
+        child = new_path(level - BITS, leaf)
+    return parent[:i] + (child,)
+
+class HashMap(object):
+    """An immutable map from atoms to values.
+
+    The map is a hash array mapped trie: each level of the trie uses the
+    next five bits of the hash of a key to choose one of 32 branches. A
+    node only holds the branches in use, with a bitmap telling which ones
+    they are. Each entry of a node is either a `(key, value)` pair, or a
+    child node for keys sharing the bits seen so far. Keys with exactly
+    the same hash end up together in a `CollisionNode`.
+
+    Like for vectors, an update copies only the path to the changed entry,
+    taking O(log32 n) steps, and shares everything else."""
+
+    __slots__ = ('count', 'root')
+
+    def __init__(self, count=0, root=None):
+        self.count = count
+        self.root = root
+
+    def find(self, key):
+        """The `(key, value)` pair for the key, or None."""
+        if self.root is None:
+            return None
+        return node_find(self.root, 0, hash_key(key), key)
+
+    def assoc(self, key, value):
+        """A map with the key bound to `value`."""
+        h = hash_key(key)
+        if self.root is None:
+            return HashMap(1, BitmapNode(bit_for(h, 0), ((key, value),)))
+        root, added = node_assoc(self.root, 0, h, key, value)
+        return HashMap(self.count + added, root)
+
+    def dissoc(self, key):
+        """A map without the key."""
+        if self.root is None:
+            return self
+        root = node_dissoc(self.root, 0, hash_key(key), key)
+        if root is self.root:
+            return self
+        return HashMap(self.count - 1, root)
+
+    def items(self):
+        if self.root is not None:
+            for pair in node_items(self.root):
+                yield pair
+
+    def __len__(self):
+        return self.count
+
+    def __eq__(self, other):
+        if not isinstance(other, HashMap) or self.count != other.count:
+            return False
+        for key, value in self.items():
+            pair = other.find(key)
+            if pair is None or pair[1] != value:
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "HashMap(%r)" % dict(self.items())
+
+class BitmapNode(object):
+
+    __slots__ = ('bitmap', 'entries')
+
+    def __init__(self, bitmap, entries):
+        self.bitmap = bitmap
+        self.entries = entries
+
+class CollisionNode(object):
+
+    __slots__ = ('hash', 'pairs')
+
+    def __init__(self, hash, pairs):
+        self.hash = hash
+        self.pairs = pairs
+
+def hash_key(key):
+    return hash(key) & 0xFFFFFFFF
+
+def bit_for(h, shift):
+    return 1 << ((h >> shift) & MASK)
+
+def entry_index(bitmap, bit):
+    """Where the entry for a bit is, among the entries of a node."""
+    return bin(bitmap & (bit - 1)).count('1')
+
+def node_find(node, shift, h, key):
+    while type(node) is BitmapNode:
+        bit = bit_for(h, shift)
+        if not node.bitmap & bit:
+            return None
+        entry = node.entries[entry_index(node.bitmap, bit)]
+        if type(entry) is tuple:
+            return entry if entry[0] == key else None
+        node = entry
+        shift += BITS
+    if node.hash == h:
+        for pair in node.pairs:
+            if pair[0] == key:
+                return pair
+    return None
+
+def node_assoc(node, shift, h, key, value):
+    """Returns the updated node, and whether a new key was added."""
+    if type(node) is CollisionNode:
+        if node.hash != h:
+            # Keys with another hash go next to the collision node.
+            node = BitmapNode(bit_for(node.hash, shift), (node,))
+            return node_assoc(node, shift, h, key, value)
+        pairs = [pair for pair in node.pairs if pair[0] != key]
+        added = len(pairs) == len(node.pairs)
+        return CollisionNode(h, tuple(pairs) + ((key, value),)), added
+
+    bit = bit_for(h, shift)
+    i = entry_index(node.bitmap, bit)
+    entries = node.entries
+    if not node.bitmap & bit:
+        entries = entries[:i] + ((key, value),) + entries[i:]
+        return BitmapNode(node.bitmap | bit, entries), True
+
+    entry = entries[i]
+    if type(entry) is not tuple:
+        child, added = node_assoc(entry, shift + BITS, h, key, value)
+    elif entry[0] == key:
+        child, added = (key, value), False
+    else:
+        child = merge(shift + BITS, entry, hash_key(entry[0]), (key, value), h)
+        added = True
+    return BitmapNode(node.bitmap, entries[:i] + (child,) + entries[i + 1:]), added
+
+def merge(shift, pair1, h1, pair2, h2):
+    """A node holding two pairs whose keys agree on the bits before `shift`."""
+    if h1 == h2:
+        return CollisionNode(h1, (pair1, pair2))
+    bit1, bit2 = bit_for(h1, shift), bit_for(h2, shift)
+    if bit1 == bit2:
+        return BitmapNode(bit1, (merge(shift + BITS, pair1, h1, pair2, h2),))
+    elif bit1 < bit2:
+        return BitmapNode(bit1 | bit2, (pair1, pair2))
+    return BitmapNode(bit1 | bit2, (pair2, pair1))
+
+def node_dissoc(node, shift, h, key):
+    """Returns the node without the key, None if that leaves it empty, or
+    the node itself if the key is not there."""
+    if type(node) is CollisionNode:
+        if node.hash != h:
+            return node
+        pairs = tuple(pair for pair in node.pairs if pair[0] != key)
+        if len(pairs) == len(node.pairs):
+            return node
+        return CollisionNode(h, pairs) if pairs else None
+
+    bit = bit_for(h, shift)
+    if not node.bitmap & bit:
+        return node
+    i = entry_index(node.bitmap, bit)
+    entry = node.entries[i]
+    if type(entry) is tuple:
+        if entry[0] != key:
+            return node
+        child = None
+    else:
+        child = node_dissoc(entry, shift + BITS, h, key)
+        if child is entry:
+            return node
+    if child is not None:
+        entries = node.entries[:i] + (child,) + node.entries[i + 1:]
+        return BitmapNode(node.bitmap, entries)
+    elif node.bitmap == bit:
+        return None
+    return BitmapNode(node.bitmap & ~bit, node.entries[:i] + node.entries[i + 1:])
+
+def node_items(node):
+    if type(node) is CollisionNode:
+        for pair in node.pairs:
+            yield pair
+        return
+    for entry in node.entries:
+        if type(entry) is tuple:
+            yield entry
+        else:
+            for pair in node_items(entry):
+                yield pair
+
+class Environment(object):
+    """A frame of variable bindings, linked to the frame it extends.
+
+    Extending an environment allocates only the new frame. Looking up a
+    symbol walks outwards through the frames until it is found, then in
+    the libraries of the frames, and then in `builtins`. Unlike other
+    variables, builtins may be defined again, which hides the builtin from
+    the environment defining it."""
+
+    # The builtin functions seen by every environment, filled in by the
+    # `natives` module.
+    builtins = {}
+
+    # How many times a definition has hidden a builtin. Caches of looked up
+    # values may keep a builtin only while this stays the same.
+    builtins_hidden = 0
+
+    # Functions looked up from call sites in frames extending this one,
+    # cached by `evaluator.lookup_function`. Made on first use.
+    call_sites = None
+
+    # The definitions of library files not evaluated yet, by name. Each is
+    # a function called with the name the first time it is looked up, which
+    # evaluates the definition in this environment and removes it from
+    # here. Set by `interpreter.load_library`.
+    library = None
+
+    def __init__(self, variables=None, parent=None):
         self.variables = variables if variables else {}
+        self.parent = parent
 
     def lookup(self, symbol):
-        if symbol in self.variables:
-            return self.variables[symbol]
-        else:
-            raise LispError(symbol)
+        env = self
+        while env is not None:
+            if symbol in env.variables:
+                return env.variables[symbol]
+            env = env.parent
+        env = self.library_defining(symbol)
+        if env is not None:
+            env.library[symbol](symbol)
+            return env.variables[symbol]
+        if symbol in self.builtins:
+            return self.builtins[symbol]
+        raise LispError(symbol)
+
+    def library_defining(self, symbol):
+        """The frame with a library definition of the symbol not evaluated
+        yet, or None."""
+        env = self
+        while env is not None:
+            if env.library and symbol in env.library:
+                return env
+            env = env.parent
+        return None
+
+    def load_libraries(self):
+        """Evaluate the library definitions not evaluated yet, in this
+        frame and the frames it extends."""
+        env = self
+        while env is not None:
+            while env.library:
+                env.lookup(next(iter(env.library)))
+            env = env.parent
 
     def extend(self, variables):
-        return Environment(
-                dict(chain(self.variables.iteritems(), variables.iteritems())))
+        return Environment(variables, self)
+
+    def binds(self, symbol):
+        """Whether the symbol is bound in this frame or any outer frame,
+        counting library definitions not evaluated yet."""
+        env = self
+        while env is not None:
+            if symbol in env.variables or (env.library and symbol in env.library):
+                return True
+            env = env.parent
+        return False
+
+    def defines(self, symbol):
+        """Whether looking up the symbol gives a value."""
+        return self.binds(symbol) or symbol in self.builtins
 
     def set(self, symbol, value):
-        if symbol in self.variables:
+        if self.binds(symbol):
             raise LispError('already defined: %s' % symbol)
         else:
+            self.hide_builtin(symbol)
             self.variables[symbol] = value
+
+    def hide_builtin(self, symbol):
+        """Note that the symbol is about to be bound in this frame."""
+        if symbol in self.builtins:
+            Environment.builtins_hidden += 1
+
+    def __getstate__(self):
+        # The call site cache is left out of images.
+        state = self.__dict__.copy()
+        state.pop('call_sites', None)
+        return state
+
+class Frame(Environment):
+    """A frame binding the parameters of a function call by position.
+
+    The analyzer resolves references to parameters into a depth and an index
+    ahead of time, and reads them straight out of `values`. For everyone else
+    a frame behaves just like any other environment."""
+
+    def __init__(self, names, values, parent):
+        self.names = names
+        self.values = values
+        self.parent = parent
+
+    @property
+    def variables(self):
+        return dict(zip(self.names, self.values))
+
+    def set(self, symbol, value):
+        if self.binds(symbol):
+            raise LispError('already defined: %s' % symbol)
+        self.hide_builtin(symbol)
+        self.names = list(self.names) + [symbol]
+        self.values.append(value)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from types import LispError, Vector, Builtin, Environment
+from ast import is_boolean, is_integer, is_vector
+from parser import unparse
+
+"""
+The vector functions of the language, registered as builtins.
+
+Vectors are `Vector` tries, so `vector-ref`, `vector-assoc` and
+`vector-push` take O(log32 n) steps, and an updated vector shares all
+but the changed path with the original. Vectors are neither atoms nor
+lists.
+"""
+
+def from_list(values):
+    vector = Vector()
+    for value in values:
+        vector = vector.push(value)
+    return vector
+
+def check_vector(vector):
+    if not is_vector(vector):
+        raise LispError('non-vector: %s' % unparse(vector))
+
+def check_index(vector, index):
+    check_vector(vector)
+    if not is_integer(index) or is_boolean(index):
+        raise LispError('Index must be an integer.')
+    if not 0 <= index < vector.count:
+        raise LispError('index out of range: %d' % index)
+
+def make_vector(*values):
+    return from_list(values)
+
+def vector_ref(vector, index):
+    check_index(vector, index)
+    return vector.nth(index)
+
+def vector_assoc(vector, index, value):
+    check_index(vector, index)
+    return vector.assoc(index, value)
+
+def vector_push(vector, value):
+    check_vector(vector)
+    return vector.push(value)
+
+def vector_length(vector):
+    check_vector(vector)
+    return vector.count
+
+builtins = {
+        'vector' : Builtin('vector', None, make_vector),
+        'vector-ref' : Builtin('vector-ref', 2, vector_ref),
+        'vector-assoc' : Builtin('vector-assoc', 3, vector_assoc),
+        'vector-push' : Builtin('vector-push', 2, vector_push),
+        'vector-length' : Builtin('vector-length', 1, vector_length)
+        }
+
+Environment.builtins.update(builtins)
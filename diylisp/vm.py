@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+from types import LispError, Closure, Builtin, Promise
+from ast import is_atom, is_integer
+from parser import unparse
+from compiler import compile_ast, CONST, LOOKUP, MATH, ATOM, EQ, JUMP, \
+    JUMP_IF_FALSE, JUMP_IF_TRUE, DEFINE, LAMBDA, DELAY, CONS, HEAD, TAIL, EMPTY, \
+    FUNCTION, CALL, RETURN, FAIL
+from lists import cons, head, tail, is_empty
+from evaluator import call_builtin
+from ivecs import ivec_math
+import operator
+
+"""
+This is the virtual machine running the instructions made by `compiler.py`.
+
+The machine is a single loop over the instructions, with an explicit stack
+of values and an explicit stack of call frames. Calling a Lisp function does
+not make a Python call, so the depth of recursion is not limited by the Python
+stack. A call in tail position replaces the current frame instead of pushing
+a new one.
+"""
+
+def execute(ast, env):
+    """Compile an AST and run it in the specified environment."""
+    return run(compile_ast(ast), env)
+
+def closure_code(closure):
+    """Compile the body of a closure made by another engine.
+
+    The result is kept on the closure."""
+    closure.code = compile_ast(closure.body)
+    return closure.code
+
+def call_closure(closure, args):
+    """Call a closure with arguments which are already evaluated, and of
+    the right number. This is how builtins call back into compiled code."""
+    try:
+        code = closure.code
+    except AttributeError:
+        code = closure_code(closure)
+    return run(code, closure.env.extend(dict(zip(closure.params, args))))
+
+def delayed(code, env):
+    """A thunk running compiled code, for `delay`."""
+    return lambda: run(code, env)
+
+def run(code, env, profile=None):
+    """Run compiled code in the specified environment.
+
+    If `profile` is a dictionary, it is updated with the number of times
+    each opcode was executed."""
+    stack = []
+    frames = []
+    pc = 0
+
+    while True:
+        op, arg = code[pc]
+        pc += 1
+        if profile is not None:
+            profile[op] = profile.get(op, 0) + 1
+
+        if op == LOOKUP:
+            stack.append(env.lookup(arg))
+        elif op == CONST:
+            stack.append(arg)
+        elif op == MATH:
+            fn, n = arg
+            if n == 2:
+                b = stack.pop()
+                a = stack.pop()
+                if not (isinstance(a, int) and isinstance(b, int)):
+                    stack.append(ivec_math(fn, [a, b]))
+                else:
+                    stack.append(fn(a, b))
+            else:
+                args = stack[len(stack) - n:]
+                del stack[len(stack) - n:]
+                if not (reduce(operator.and_, [is_integer(x) for x in args])):
+                    stack.append(ivec_math(fn, args))
+                else:
+                    stack.append(reduce(fn, args))
+        elif op == JUMP_IF_FALSE:
+            if not stack.pop():
+                pc = arg
+        elif op == JUMP:
+            pc = arg
+        elif op == JUMP_IF_TRUE:
+            if stack.pop():
+                pc = arg
+        elif op == FUNCTION:
+            if not isinstance(stack[-1], (Closure, Builtin)):
+                raise LispError('not a function: %s' % unparse(stack[-1]))
+        elif op == CALL:
+            args = stack[len(stack) - arg:]
+            del stack[len(stack) - arg:]
+            closure = stack.pop()
+            if isinstance(closure, Builtin):
+                stack.append(call_builtin(closure, args, call_closure))
+                continue
+            params = closure.params
+            if arg != len(params):
+                raise LispError('wrong number of arguments, expected %d got %d'
+                        % (len(params), arg))
+            if code[pc][0] != RETURN:
+                frames.append((code, pc, env))
+            try:
+                code = closure.code
+            except AttributeError:
+                code = closure_code(closure)
+            pc = 0
+            env = closure.env.extend(dict(zip(params, args)))
+        elif op == RETURN:
+            if not frames:
+                return stack.pop()
+            code, pc, env = frames.pop()
+        elif op == EQ:
+            b = stack.pop()
+            a = stack.pop()
+            stack.append(is_atom(a) and a == b)
+        elif op == HEAD:
+            stack.append(head(stack.pop()))
+        elif op == TAIL:
+            stack.append(tail(stack.pop()))
+        elif op == EMPTY:
+            stack.append(is_empty(stack.pop()))
+        elif op == CONS:
+            rest = stack.pop()
+            stack.append(cons(stack.pop(), rest))
+        elif op == ATOM:
+            stack.append(is_atom(stack.pop()))
+        elif op == LAMBDA:
+            params, body, body_code = arg
+            closure = Closure(env, params, body)
+            closure.code = body_code
+            stack.append(closure)
+        elif op == DELAY:
+            stack.append(Promise(delayed(arg[1], env)))
+        elif op == DEFINE:
+            env.set(arg, stack.pop())
+            stack.append("")
+        elif op == FAIL:
+            raise arg
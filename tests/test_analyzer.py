@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp, assert_is_instance
+from os.path import dirname, relpath, join
+
+from diylisp.analyzer import analyze, execute, unbound_variables
+from diylisp.evaluator import evaluate
+from diylisp.interpreter import interpret, interpret_file
+from diylisp.parser import parse
+from diylisp.types import Closure, LispError, Environment, Frame
+
+"""
+Tests for the analyzing engine. It should give exactly the same results as
+`evaluate`, so most tests simply run a program through both.
+"""
+
+def assert_same_as_evaluate(source, env_factory=Environment):
+    expected = evaluate(parse(source), env_factory())
+    assert_equals(expected, execute(parse(source), env_factory()))
+
+def test_simple_expressions():
+    assert_same_as_evaluate("#t")
+    assert_same_as_evaluate("42")
+    assert_same_as_evaluate("'foo")
+    assert_same_as_evaluate("'(1 2 #f)")
+    assert_same_as_evaluate("(atom '(1 2))")
+    assert_same_as_evaluate("(eq 'foo 'foo)")
+    assert_same_as_evaluate("(eq '(1) '(1))")
+    assert_same_as_evaluate("(eq #f (> (- (+ 1 3) (* 2 (mod 7 4))) 4))")
+    assert_same_as_evaluate("(/ 7 2)")
+
+def test_lists():
+    assert_same_as_evaluate("(cons 3 (cons (- 4 2) (cons 1 '())))")
+    assert_same_as_evaluate("(head '(1 2 3))")
+    assert_same_as_evaluate("(tail '(1 2 3))")
+    assert_same_as_evaluate("(empty (tail '(1)))")
+
+def test_only_correct_branch_is_evaluated():
+    assert_equals(42, execute(parse("(if #f (this should not be evaluated) 42)"),
+                              Environment()))
+
+def test_malformed_form_is_reported_when_run():
+    """Analysis must not fail on malformed forms that are never run."""
+
+    proc = analyze(parse("(if #t 42 (if #t))"))
+    assert_equals(42, proc(Environment()))
+
+    with assert_raises_regexp(LispError, "too few arguments"):
+        proc = analyze(parse("(lambda (x) (if x))"))
+        closure = proc(Environment())
+        execute([closure, True], Environment())
+
+def test_lambda_gives_closure():
+    env = Environment()
+    closure = execute(parse("(lambda (x y) (+ x y))"), env)
+    assert_is_instance(closure, Closure)
+    assert_equals(["x", "y"], closure.params)
+    assert_equals(["+", "x", "y"], closure.body)
+    assert_equals(env, closure.env)
+
+def test_calls_and_free_variables():
+    closure = execute(parse("(lambda (x) (+ x y))"), Environment({"y": 1}))
+    assert_equals(1, execute([closure, 0], Environment({"y": 2})))
+    assert_equals(5, execute(parse("((if #f nope (lambda (x) (+ x y))) 2)"),
+                             Environment({"y": 3})))
+
+def test_call_errors():
+    with assert_raises_regexp(LispError, "not a function"):
+        execute(parse("(#t 'foo 'bar)"), Environment())
+
+    env = Environment()
+    execute(parse("(define fn (lambda (p1 p2) 'whatwever))"), env)
+    with assert_raises_regexp(LispError, "wrong number of arguments, expected 2 got 3"):
+        execute(parse("(fn 1 2 3)"), env)
+
+    with assert_raises_regexp(LispError, "Arguments must be integers"):
+        execute(parse("(+ 1 'foo)"), Environment())
+
+def test_recursive_function():
+    env = Environment()
+    execute(parse("""
+        (define fact
+            (lambda (n)
+                (if (eq n 0)
+                    1
+                    (* n (fact (- n 1))))))
+    """), env)
+    assert_equals(120, execute(parse("(fact 5)"), env))
+
+def test_calling_closures_made_by_evaluate():
+    env = Environment()
+    evaluate(parse("(define add (lambda (x y) (+ x y)))"), env)
+    assert_equals(3, execute(parse("(add 1 2)"), env))
+
+def test_interpret_with_stdlib():
+    env = Environment()
+    path = join(dirname(relpath(__file__)), '..', 'stdlib.diy')
+    interpret_file(path, env, engine='analyze')
+    assert_equals("#t", interpret("(xor #t #f)", env, engine='analyze'))
+    assert_equals("10", interpret("(sum '(1 2 3 4))", env, engine='analyze'))
+    assert_equals("3", interpret("(length '(#t '(1 2 3) 'foo-bar))", env,
+                                 engine='analyze'))
+
+def test_parameters_are_bound_in_frames():
+    closure = execute(parse("(lambda (x y) (lambda () (+ x y)))"), Environment())
+    inner = execute([closure, 1, 2], Environment())
+    assert_is_instance(inner.env, Frame)
+    assert_equals([1, 2], inner.env.values)
+    assert_equals(3, execute([inner], Environment()))
+
+def test_frames_work_with_evaluate():
+    make_adder = execute(parse("(lambda (x) (lambda (y) (+ x y)))"), Environment())
+    adder = execute([make_adder, 40], Environment())
+    assert_equals(42, evaluate([adder, 2], Environment()))
+
+def test_define_inside_lambda():
+    env = Environment()
+    execute(parse("""
+        (define f
+            (lambda (x)
+                (if (define y (+ x 1))
+                    y
+                    y)))
+    """), env)
+    assert_equals(2, execute(parse("(f 1)"), env))
+    with assert_raises_regexp(LispError, "already defined: x"):
+        execute(parse("((lambda (x) (define x 2)) 1)"), env)
+
+def test_free_variables_are_looked_up_in_each_environment():
+    proc = analyze(parse("(lambda () foo)"))
+    first = proc(Environment({"foo": 1}))
+    second = proc(Environment({"foo": 2}))
+    assert_equals(1, execute([first], Environment()))
+    assert_equals(2, execute([second], Environment()))
+    assert_equals(1, execute([first], Environment()))
+
+def test_unbound_variables():
+    env = Environment({"known": 1})
+    ast = parse("""
+        (define f
+            (lambda (x)
+                (if (eq x 0)
+                    (+ known 'quoted-symbol)
+                    (f (- x misspelled)))))
+    """)
+    assert_equals(["misspelled"], unbound_variables(ast, env))
+    assert_equals(["y"], unbound_variables(parse("(lambda (x) (+ x y))"), env))
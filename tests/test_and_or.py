@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp
+from os.path import dirname, relpath, join
+
+from diylisp import analyzer, continuations, vm
+from diylisp.evaluator import evaluate
+from diylisp.interpreter import interpret, interpret_file
+from diylisp.parser import parse
+from diylisp.types import Environment, LispError
+
+"""
+`and` and `or` are special forms, evaluating their arguments from left to
+right only as far as needed. Every engine should agree on the results.
+"""
+
+engines = [evaluate, analyzer.execute, vm.execute, continuations.execute]
+
+def assert_all_engines(expected, source, env_factory=Environment):
+    for engine in engines:
+        assert_equals(expected, engine(parse(source), env_factory()))
+
+def test_and():
+    assert_all_engines(True, "(and #t #t)")
+    assert_all_engines(False, "(and #t #f)")
+    assert_all_engines(False, "(and #f #t)")
+    assert_all_engines(42, "(and #t 42)")
+
+def test_or():
+    assert_all_engines(True, "(or #t #f)")
+    assert_all_engines(True, "(or #f #t)")
+    assert_all_engines(False, "(or #f #f)")
+    assert_all_engines(True, "(or 1 #f)")
+    assert_all_engines(42, "(or #f 42)")
+
+def test_variadic():
+    assert_all_engines(True, "(and)")
+    assert_all_engines(False, "(or)")
+    assert_all_engines(7, "(and 7)")
+    assert_all_engines(7, "(or 7)")
+    assert_all_engines(3, "(and 1 2 3)")
+    assert_all_engines(False, "(and 1 #f 3)")
+    assert_all_engines(3, "(or #f #f 3)")
+    assert_all_engines(3, "(and #t (+ 1 2))")
+
+def test_arguments_are_only_evaluated_when_needed():
+    assert_all_engines(True, "(or #t (head '()))")
+    assert_all_engines(False, "(and #f (undefined-function 1))")
+    assert_all_engines(False, "(and (> 1 2) (head '()))")
+
+    for engine in engines:
+        with assert_raises_regexp(LispError, "empty list"):
+            engine(parse("(or #f (head '()))"), Environment())
+
+def test_guarded_recursion():
+    def env_factory():
+        env = Environment()
+        evaluate(parse("""
+            (define all-positive
+                (lambda (l)
+                    (or (empty l)
+                        (and (> (head l) 0)
+                             (all-positive (tail l))))))
+        """), env)
+        env.set("numbers", range(1, 301))
+        return env
+    assert_all_engines(True, "(all-positive numbers)", env_factory)
+    assert_all_engines(False, "(all-positive (cons 1 (cons 0 numbers)))",
+                       env_factory)
+
+def test_stdlib_versions_are_still_values():
+    env = Environment()
+    path = join(dirname(relpath(__file__)), '..', 'stdlib.diy')
+    interpret_file(path, env)
+    interpret("(define apply2 (lambda (f a b) (f a b)))", env)
+    assert_equals("#t", interpret("(apply2 or #f #t)", env))
+    assert_equals("#f", interpret("(apply2 and #t #f)", env))
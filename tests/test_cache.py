@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp, with_setup
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from diylisp import cache, interpreter
+from diylisp.cache import cache_path, cache_key, load, save
+from diylisp.interpreter import interpret_file
+from diylisp.parser import parse_multiple
+from diylisp.types import Environment, LispError
+
+"""
+The parsed expressions of files are cached next to them, and the cache is
+used only while it matches the source.
+"""
+
+directory = None
+path = None
+
+def make_directory():
+    global directory, path
+    directory = mkdtemp()
+    path = join(directory, 'program.diy')
+
+def remove_directory():
+    rmtree(directory)
+
+def write(source):
+    with open(path, 'w') as sourcefile:
+        sourcefile.write(source)
+
+@with_setup(make_directory, remove_directory)
+def test_cache_is_written_and_used():
+    source = "(define x 20) (+ x 22)"
+    write(source)
+    assert_equals("42", interpret_file(path, Environment()))
+    assert exists(cache_path(path))
+    assert_equals(parse_multiple(source), load(cache_path(path), cache_key(source)))
+
+    # Planting other expressions under the right key shows they are used.
+    save(cache_path(path), cache_key(source), [['+', 1, 2]])
+    assert_equals("3", interpret_file(path, Environment()))
+
+@with_setup(make_directory, remove_directory)
+def test_stale_cache_is_ignored():
+    write("(+ 1 2)")
+    interpret_file(path, Environment())
+    write("(+ 1 3)")
+    assert_equals("4", interpret_file(path, Environment()))
+    assert_equals([['+', 1, 3]], load(cache_path(path), cache_key("(+ 1 3)")))
+
+@with_setup(make_directory, remove_directory)
+def test_cache_for_other_version_is_ignored():
+    write("(+ 1 2)")
+    interpret_file(path, Environment())
+    original = cache.cache_version
+    try:
+        cache.cache_version = original + 1
+        assert_equals(None, load(cache_path(path), cache_key("(+ 1 2)")))
+    finally:
+        cache.cache_version = original
+
+@with_setup(make_directory, remove_directory)
+def test_damaged_cache_is_ignored():
+    write("(+ 1 2)")
+    interpret_file(path, Environment())
+    with open(cache_path(path), 'rb') as cachefile:
+        data = cachefile.read()
+    for damaged in ["", "garbage", data[:-3], data[:-1] + 'x', data + 'x']:
+        with open(cache_path(path), 'wb') as cachefile:
+            cachefile.write(damaged)
+        assert_equals("3", interpret_file(path, Environment()))
+
+@with_setup(make_directory, remove_directory)
+def test_no_cache_for_deep_nesting():
+    depth = 5000
+    write("(define x '" + "(" * depth + "y" + ")" * depth + ")")
+    env = Environment()
+    interpret_file(path, env)
+    ast = env.lookup('x')
+    for _ in range(depth - 1):
+        ast = ast[0]
+    assert_equals(['y'], ast)
+    assert not exists(cache_path(path))
+
+@with_setup(make_directory, remove_directory)
+def test_no_cache_for_incomplete_source():
+    write("(define x 1) (foo")
+    with assert_raises_regexp(LispError, "Incomplete expression"):
+        interpret_file(path, Environment())
+    assert not exists(cache_path(path))
+
+@with_setup(make_directory, remove_directory)
+def test_no_cache_for_large_files():
+    original = interpreter.cache_threshold
+    try:
+        interpreter.cache_threshold = 10
+        write("(define x 20) (+ x 22)")
+        assert_equals("42", interpret_file(path, Environment()))
+        assert not exists(cache_path(path))
+    finally:
+        interpreter.cache_threshold = original
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp, assert_is_instance
+from os.path import dirname, relpath, join
+
+from diylisp.continuations import execute
+from diylisp.evaluator import evaluate
+from diylisp.interpreter import interpret, interpret_file
+from diylisp.parser import parse
+from diylisp.types import Closure, LispError, Environment
+
+"""
+Tests for the evaluator keeping its control stack on the heap.
+"""
+
+def assert_same_as_evaluate(source):
+    expected = evaluate(parse(source), Environment())
+    assert_equals(expected, execute(parse(source), Environment()))
+
+def test_simple_expressions():
+    assert_same_as_evaluate("#t")
+    assert_same_as_evaluate("'(1 2 #f)")
+    assert_same_as_evaluate("(atom '(1 2))")
+    assert_same_as_evaluate("(eq 'foo 'foo)")
+    assert_same_as_evaluate("(eq #f (> (- (+ 1 3) (* 2 (mod 7 4))) 4))")
+    assert_same_as_evaluate("(if (> 1 2) (- 1000 1) (+ 40 (- 3 1)))")
+    assert_same_as_evaluate("(cons 3 (cons (- 4 2) (cons 1 '())))")
+    assert_same_as_evaluate("(tail (tail '(1 2 3)))")
+
+def test_errors():
+    with assert_raises_regexp(LispError, "Arguments must be integers"):
+        execute(parse("(+ 1 'foo)"), Environment())
+    with assert_raises_regexp(LispError, "empty list"):
+        execute(parse("(head '())"), Environment())
+    with assert_raises_regexp(LispError, "not a function"):
+        execute(parse("(#t 'foo 'bar)"), Environment())
+    with assert_raises_regexp(LispError, "too many arguments"):
+        execute(parse("(atom 1 2)"), Environment())
+    with assert_raises_regexp(LispError, "Wrong number of arguments"):
+        execute(parse("(define x)"), Environment())
+
+def test_define_and_call():
+    env = Environment()
+    execute(parse("(define fn (lambda (p1 p2) (+ p1 p2)))"), env)
+    assert_is_instance(env.lookup("fn"), Closure)
+    assert_equals(3, execute(parse("(fn 1 2)"), env))
+    with assert_raises_regexp(LispError, "wrong number of arguments, expected 2 got 3"):
+        execute(parse("(fn 1 2 3)"), env)
+
+def test_deep_non_tail_recursion():
+    """Recursion depth is not limited by the Python stack."""
+
+    env = Environment()
+    execute(parse("""
+        (define count
+            (lambda (n)
+                (if (eq n 0) 0 (+ 1 (count (- n 1))))))
+    """), env)
+    assert_equals(20000, execute(parse("(count 20000)"), env))
+
+def test_stdlib_on_long_lists():
+    env = Environment({"numbers": range(3000)})
+    path = join(dirname(relpath(__file__)), '..', 'stdlib.diy')
+    interpret_file(path, env, engine='continuations')
+    assert_equals(str(sum(range(3000))),
+                  interpret("(sum numbers)", env, engine='continuations'))
+    assert_equals("3000", interpret("(length numbers)", env, engine='continuations'))
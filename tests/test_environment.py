@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp, assert_true, \
+    assert_false
+
+from diylisp.types import LispError, Environment, Frame
+
+"""
+Tests for the linked frames of the `Environment`.
+"""
+
+def test_extend_links_to_parent_without_copying():
+    env = Environment({"foo": 1})
+    extended = env.extend({"bar": 2})
+    assert_equals(env, extended.parent)
+    assert_equals({"bar": 2}, extended.variables)
+
+def test_lookup_walks_outwards():
+    env = Environment({"a": 1}).extend({"b": 2}).extend({"a": 3})
+    assert_equals(3, env.lookup("a"))
+    assert_equals(2, env.lookup("b"))
+    assert_equals(1, env.parent.parent.lookup("a"))
+
+def test_outer_definitions_are_visible_after_extending():
+    env = Environment()
+    extended = env.extend({"x": 1})
+    env.set("y", 2)
+    assert_equals(2, extended.lookup("y"))
+
+def test_defines():
+    env = Environment({"a": 1}).extend({"b": 2})
+    assert_true(env.defines("a"))
+    assert_true(env.defines("b"))
+    assert_false(env.defines("c"))
+
+def test_set_cannot_redefine_variable_from_outer_frame():
+    env = Environment({"foo": 1}).extend({"bar": 2})
+    with assert_raises_regexp(LispError, "already defined: foo"):
+        env.set("foo", 3)
+    env.set("baz", 3)
+    assert_equals(3, env.lookup("baz"))
+    with assert_raises_regexp(LispError, "baz"):
+        env.parent.lookup("baz")
+
+def test_frame_behaves_like_environment():
+    frame = Frame(["x", "y"], [1, 2], Environment({"z": 3}))
+    assert_equals(2, frame.lookup("y"))
+    assert_equals(3, frame.extend({}).lookup("z"))
+    assert_equals({"x": 1, "y": 2}, frame.variables)
+
+    frame.set("w", 4)
+    assert_equals(4, frame.lookup("w"))
+    assert_equals([1, 2, 4], frame.values)
+    with assert_raises_regexp(LispError, "already defined: z"):
+        frame.set("z", 5)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp, assert_is
+import random
+
+from diylisp import analyzer, continuations, vm
+from diylisp.evaluator import evaluate
+from diylisp.hashmaps import from_pairs
+from diylisp.interpreter import interpret
+from diylisp.parser import parse, unparse
+from diylisp.types import Environment, LispError, HashMap
+
+"""
+Hash maps are persistent hash array mapped tries. Updates give a new map
+sharing most of its nodes with the old one, which is left unchanged.
+"""
+
+engines = [evaluate, analyzer.execute, vm.execute, continuations.execute]
+
+def assert_all_engines(expected, source, env_factory=Environment):
+    for engine in engines:
+        assert_equals(expected, engine(parse(source), env_factory()))
+
+def test_same_as_dict():
+    rng = random.Random(42)
+    expected = {}
+    hash_map = HashMap()
+    for _ in range(5000):
+        key = rng.choice([rng.randint(-300, 300), "sym%d" % rng.randint(0, 300)])
+        if rng.random() < 0.3:
+            expected.pop(key, None)
+            hash_map = hash_map.dissoc(key)
+        else:
+            value = rng.randint(0, 1000)
+            expected[key] = value
+            hash_map = hash_map.assoc(key, value)
+        assert_equals(len(expected), len(hash_map))
+    assert_equals(expected, dict(hash_map.items()))
+    for key in expected:
+        assert_equals((key, expected[key]), hash_map.find(key))
+
+def test_colliding_keys():
+    assert_equals(hash(-1), hash(-2))
+    hash_map = from_pairs([(-1, 'a'), (-2, 'b'), (30, 'c')])
+    assert_equals(3, len(hash_map))
+    assert_equals('a', hash_map.find(-1)[1])
+    assert_equals('b', hash_map.find(-2)[1])
+    hash_map = hash_map.dissoc(-1)
+    assert_equals(None, hash_map.find(-1))
+    assert_equals('b', hash_map.find(-2)[1])
+    assert_equals(HashMap(), hash_map.dissoc(-2).dissoc(30))
+
+def test_updates_share_structure():
+    old = from_pairs((i, i) for i in range(1000))
+    new = old.assoc(5, 'five')
+    assert_equals(5, old.find(5)[1])
+    assert_equals('five', new.find(5)[1])
+    shared = [a for a, b in zip(old.root.entries, new.root.entries) if a is b]
+    assert_equals(len(old.root.entries) - 1, len(shared))
+    assert_is(old, old.dissoc('missing'))
+
+def test_primitives():
+    assert_all_engines(2, "(get (hash-map 'a 1 'b 2) 'b)")
+    assert_all_engines(True, "(contains? (hash-map 'a 1) 'a)")
+    assert_all_engines(False, "(contains? (dissoc (hash-map 'a 1) 'a) 'a)")
+    assert_all_engines(3, "(count (assoc (hash-map 1 'a #f 'b) 'c 'c))")
+    assert_all_engines(from_pairs([('a', 2)]), "(assoc (hash-map 'a 1) 'a 2)")
+    assert_all_engines(0, "(count (hash-map))")
+
+def test_functions_are_builtins():
+    for engine in engines:
+        env = Environment()
+        engine(parse("(define count (lambda (n) (+ n 1)))"), env)
+        assert_equals(6, engine(parse("(count 5)"), env))
+        assert_equals('b', engine(parse("((lambda (get) (get 1)) (lambda (x) 'b))"),
+                                  Environment()))
+    assert_all_engines([1, 0], "(map count (cons (hash-map 'a 1) (cons (hash-map) '())))")
+
+def test_keys_are_the_same_when_eq():
+    assert_equals(True, evaluate(parse("(eq 1 #t)"), Environment()))
+    assert_all_engines('one', "(get (hash-map 1 'one) #t)")
+
+def test_errors():
+    for engine in engines:
+        with assert_raises_regexp(LispError, "missing key: c"):
+            engine(parse("(get (hash-map 'a 1) 'c)"), Environment())
+        with assert_raises_regexp(LispError, "invalid key: \(1\)"):
+            engine(parse("(hash-map '(1) 1)"), Environment())
+        with assert_raises_regexp(LispError, "hash-map needs a value"):
+            engine(parse("(hash-map 'a)"), Environment())
+        with assert_raises_regexp(LispError, "non-hash-map: 1"):
+            engine(parse("(count 1)"), Environment())
+
+def test_unparse():
+    assert_equals("{a 1 b (1 2)}", unparse(from_pairs([('b', [1, 2]), ('a', 1)])))
+    assert_equals("{}", interpret("(hash-map)"))
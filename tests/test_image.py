@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp, with_setup
+from os.path import exists
+from os import remove
+from tempfile import mkstemp
+
+from diylisp.image import save_image, load_image
+from diylisp.interpreter import interpret, load_stdlib
+from diylisp.types import Cons, Environment, LispError
+
+"""
+Images save an environment to a file, to be loaded again later with the
+same variables, closures and shared values.
+"""
+
+path = None
+
+def make_path():
+    global path
+    path = mkstemp(suffix='.img')[1]
+
+def remove_path():
+    if exists(path):
+        remove(path)
+
+def saved_and_loaded(env):
+    save_image(env, path)
+    return load_image(path)
+
+@with_setup(make_path, remove_path)
+def test_variables_and_closures_survive():
+    env = Environment()
+    load_stdlib(env)
+    interpret("""(define fact
+                     (lambda (n) (if (eq n 0) 1 (* n (fact (- n 1))))))""", env)
+    interpret("(define add (lambda (x) (lambda (y) (+ x y))))", env)
+    interpret("(define add-two (add 2))", env)
+    loaded = saved_and_loaded(env)
+    for engine in ['evaluate', 'analyze', 'vm', 'continuations']:
+        assert_equals("3628800", interpret("(fact 10)", loaded, engine))
+        assert_equals("5", interpret("(add-two 3)", loaded, engine))
+        assert_equals("#t", interpret("(<= 1 2)", loaded, engine))
+
+@with_setup(make_path, remove_path)
+def test_sharing_and_cycles_are_kept():
+    env = Environment()
+    interpret("(define xs (cons 1 (cons 2 '())))", env)
+    interpret("(define ys (cons 0 xs))", env)
+    interpret("(define f (lambda () f))", env)
+    loaded = saved_and_loaded(env)
+    assert loaded.lookup('ys').tail is loaded.lookup('xs')
+    assert loaded.lookup('f').env is loaded
+    assert_equals("#t", interpret("(eq (f) f)", loaded))
+
+@with_setup(make_path, remove_path)
+def test_long_lists():
+    xs = []
+    for n in range(5000, 0, -1):
+        xs = Cons(n, xs)
+    env = Environment({'xs': xs})
+    interpret("(define ys (cons 0 (tail (tail xs))))", env)
+    interpret("(define numbers (range 1 5000))", env)
+    interpret("(sum numbers)", env)
+    loaded = saved_and_loaded(env)
+    assert_equals("12502500", interpret("(sum xs)", loaded))
+    assert_equals("12502497", interpret("(sum ys)", loaded))
+    assert_equals("12502500", interpret("(sum numbers)", loaded))
+    xs, ys = loaded.lookup('xs'), loaded.lookup('ys')
+    assert ys.tail is xs.tail.tail
+
+    # Saving again works just as well.
+    assert_equals("12502497", interpret("(sum ys)", saved_and_loaded(loaded)))
+
+@with_setup(make_path, remove_path)
+def test_builtins_are_saved_by_name():
+    env = Environment()
+    interpret("(define my-map map)", env)
+    interpret("(define total (lambda (xs) (sum (map (lambda (x) (* x x)) xs))))", env)
+    interpret("(define v (vector 1 2))", env)
+    interpret("(define m (hash-map 'a 1))", env)
+    loaded = saved_and_loaded(env)
+    assert loaded.lookup('my-map') is Environment.builtins['map']
+    assert_equals("14", interpret("(total '(1 2 3))", loaded))
+    assert_equals("2", interpret("(vector-ref v 1)", loaded))
+    assert_equals("1", interpret("(get m 'a)", loaded))
+
+@with_setup(make_path, remove_path)
+def test_values_which_cannot_be_saved():
+    env = Environment()
+    interpret("(define p (delay (+ 1 2)))", env)
+    with assert_raises_regexp(LispError, "before it is forced"):
+        save_image(env, path)
+    interpret("(force p)", env)
+    assert_equals("3", interpret("(force p)", saved_and_loaded(env)))
+
+    env = Environment()
+    interpret("(define numbers (range 1 10))", env)
+    with assert_raises_regexp(LispError, "before it is computed"):
+        save_image(env, path)
+
+@with_setup(make_path, remove_path)
+def test_loading_something_else():
+    with open(path, 'w') as imagefile:
+        imagefile.write("(define x 1)")
+    with assert_raises_regexp(LispError, "not an image"):
+        load_image(path)
+    save_image(Environment({'x': 1}), path)
+    with open(path, 'rb') as imagefile:
+        data = imagefile.read()
+    with open(path, 'wb') as imagefile:
+        imagefile.write(data[:len(data) // 2])
+    with assert_raises_regexp(LispError, "damaged image"):
+        load_image(path)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals
+
+from diylisp.evaluator import evaluate, cache_stats
+from diylisp.parser import parse
+from diylisp.types import Environment
+
+"""
+Tests for the caching of functions looked up at call sites. Evaluating an
+AST must never change it, and a cached function must never be used in an
+environment where the call site means something else.
+"""
+
+def test_evaluate_does_not_change_the_ast():
+    env = Environment()
+    evaluate(parse("(define double (lambda (x) (+ x x)))"), env)
+    ast = parse("(double ((lambda (y) y) 21))")
+    evaluate(ast, env)
+    assert_equals(parse("(double ((lambda (y) y) 21))"), ast)
+
+def test_same_ast_in_different_environments():
+    ast = parse("(f 1)")
+    one = evaluate(parse("(lambda (x) 'one)"), Environment())
+    two = evaluate(parse("(lambda (x) 'two)"), Environment())
+    assert_equals("one", evaluate(ast, Environment({"f": one})))
+    assert_equals("two", evaluate(ast, Environment({"f": two})))
+
+def test_call_site_calling_a_parameter():
+    env = Environment()
+    evaluate(parse("(define call (lambda (g x) (g x)))"), env)
+    evaluate(parse("(define inc (lambda (x) (+ x 1)))"), env)
+    evaluate(parse("(define dec (lambda (x) (- x 1)))"), env)
+    assert_equals(2, evaluate(parse("(call inc 1)"), env))
+    assert_equals(0, evaluate(parse("(call dec 1)"), env))
+
+def test_same_closure_body_in_different_environments():
+    env = Environment()
+    evaluate(parse("(define make (lambda (f) (lambda (x) (f x))))"), env)
+    evaluate(parse("(define first (make (lambda (x) 'first)))"), env)
+    evaluate(parse("(define second (make (lambda (x) 'second)))"), env)
+    assert_equals("first", evaluate(parse("(first 1)"), env))
+    assert_equals("second", evaluate(parse("(second 1)"), env))
+
+def test_repeated_calls_hit_the_cache():
+    env = Environment()
+    evaluate(parse("""
+        (define count-down
+            (lambda (n)
+                (if (eq n 0) 0 (count-down (- n 1)))))
+    """), env)
+    hits, misses = cache_stats['hits'], cache_stats['misses']
+    evaluate(parse("(count-down 100)"), env)
+    assert_equals(1, cache_stats['misses'] - misses)
+    assert_equals(99, cache_stats['hits'] - hits)
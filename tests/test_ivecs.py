@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp
+from array import array
+
+from diylisp import analyzer, continuations, vm
+from diylisp.ast import is_atom, is_list, is_ivec
+from diylisp.evaluator import evaluate
+from diylisp.interpreter import interpret
+from diylisp.parser import parse
+from diylisp.types import Environment, LispError
+
+"""
+Numeric vectors are arrays of machine integers, on which the math
+operators work element by element.
+"""
+
+engines = [evaluate, analyzer.execute, vm.execute, continuations.execute]
+
+def ivec(*values):
+    return array('l', values)
+
+def assert_all_engines(expected, source, env_factory=Environment):
+    for engine in engines:
+        assert_equals(expected, engine(parse(source), env_factory()))
+
+def test_making_ivecs():
+    assert_all_engines(ivec(1, 2, 3), "(ivec 1 (+ 1 1) 3)")
+    assert_all_engines(ivec(), "(ivec)")
+    assert_all_engines(ivec(2, 3, 4), "(irange 2 5)")
+    assert_all_engines(ivec(1, 2), "(list->ivec (cons 1 '(2)))")
+    assert_all_engines([1, 2], "(ivec->list (ivec 1 2))")
+
+def test_elementwise_math():
+    assert_all_engines(ivec(11, 22), "(+ (ivec 1 2) (ivec 10 20))")
+    assert_all_engines(ivec(2, 4, 6), "(* 2 (irange 1 4))")
+    assert_all_engines(ivec(9, 8), "(- 10 (ivec 1 2))")
+    assert_all_engines(ivec(1, 0, 1), "(mod (irange 1 4) 2)")
+    assert_all_engines(ivec(0, 0, 1), "(> (irange 1 4) 2)")
+    assert_all_engines(ivec(3, 4), "(+ 1 (ivec 1 2) 1)")
+    assert_all_engines(ivec(2, 2), "(/ (ivec 5 7) (ivec 2 3))")
+
+def test_reductions():
+    assert_all_engines(10, "(vsum (irange 0 5))")
+    assert_all_engines(7, "(vmax (ivec 3 7 -1))")
+    assert_all_engines(32, "(vdot (ivec 1 2 3) (ivec 4 5 6))")
+
+def test_errors():
+    for engine in engines:
+        with assert_raises_regexp(LispError, "ivecs of different lengths: 2 and 3"):
+            engine(parse("(+ (ivec 1 2) (ivec 1 2 3))"), Environment())
+        with assert_raises_regexp(LispError, "Arguments must be integers"):
+            engine(parse("(+ (ivec 1 2) 'a)"), Environment())
+        with assert_raises_regexp(LispError, "Arguments must be integers"):
+            engine(parse("(ivec 1 #t '(1))"), Environment())
+        with assert_raises_regexp(LispError, "non-ivec: \(1 2\)"):
+            engine(parse("(vsum '(1 2))"), Environment())
+        with assert_raises_regexp(LispError, "empty ivec"):
+            engine(parse("(vmax (ivec))"), Environment())
+        with assert_raises_regexp(LispError, "too large"):
+            engine(parse("(* (ivec 4611686018427387904) 4)"), Environment())
+
+def test_ivecs_are_neither_atoms_nor_lists():
+    assert is_ivec(ivec(1))
+    assert not is_atom(ivec(1))
+    assert not is_list(ivec(1))
+
+def test_unparse():
+    assert_equals("#i(1 -2 3)", interpret("(ivec 1 -2 3)"))
+    assert_equals("#i()", interpret("(irange 3 3)"))
+
+def test_long_ivecs():
+    env = Environment()
+    interpret("(define xs (irange 0 1000000))", env)
+    assert_equals(str(sum(x * x for x in range(1000000))),
+                  interpret("(vdot xs xs)", env))
+    assert_equals("999998", interpret("(vmax (- xs 1))", env))
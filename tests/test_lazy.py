@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp
+import gc
+
+from diylisp import analyzer, continuations, vm
+from diylisp.ast import is_list, is_promise
+from diylisp.evaluator import evaluate
+from diylisp.interpreter import interpret
+from diylisp.lazy import lazy_range
+from diylisp.natives import native_sum
+from diylisp.parser import parse, unparse
+from diylisp.types import Environment, LispError, Builtin, Promise, LazySeq
+
+"""
+Promises made by `delay` are evaluated when forced, and only once. Lazy
+lists compute their elements when they are needed, and work with the list
+forms and builtins like other lists.
+"""
+
+engines = [evaluate, analyzer.execute, vm.execute, continuations.execute]
+
+def assert_all_engines(expected, source, env_factory=Environment):
+    for engine in engines:
+        assert_equals(expected, engine(parse(source), env_factory()))
+
+def counting_env(calls):
+    def tick():
+        calls.append(1)
+        return len(calls)
+    return Environment({'tick': Builtin('tick', 0, tick)})
+
+def test_delay_gives_a_promise():
+    for engine in engines:
+        assert is_promise(engine(parse("(delay (head '()))"), Environment()))
+
+def test_force():
+    assert_all_engines(3, "(force (delay (+ 1 2)))")
+    assert_all_engines(3, "((lambda (x) (force (delay (+ x 1)))) 2)")
+    assert_all_engines(5, "(force 5)")
+
+def test_promises_are_forced_once():
+    for engine in engines:
+        calls = []
+        env = counting_env(calls)
+        engine(parse("(define p (delay (tick)))"), env)
+        assert_equals([], calls)
+        assert_equals(1, engine(parse("(force p)"), env))
+        assert_equals(1, engine(parse("(force p)"), env))
+        assert_equals(1, len(calls))
+
+def test_forcing_again_from_within_the_thunk():
+    values = iter([1, 2])
+    def thunk():
+        value = next(values)
+        if value == 1:
+            promise.force()
+        return value
+    promise = Promise(thunk)
+    # The inner force finishes first, and its value is the one kept.
+    assert_equals(2, promise.force())
+    assert_equals(2, promise.force())
+
+def test_lazy_cons():
+    assert_all_engines([1, 2], "(lazy-cons 1 (delay (cons 2 '())))")
+    assert_all_engines(2, "(head (tail (lazy-cons 1 (delay '(2 3)))))")
+    assert_all_engines(False, "(empty (lazy-cons 1 (delay (head '()))))")
+    assert_all_engines([1], "(lazy-cons 1 '())")
+
+def test_lazy_cons_needs_a_list():
+    for engine in engines:
+        with assert_raises_regexp(LispError, 'non-list'):
+            engine(parse("(lazy-cons 1 2)"), Environment())
+        with assert_raises_regexp(LispError, 'non-list'):
+            engine(parse("(head (tail (lazy-cons 1 (delay 2))))"), Environment())
+
+def test_range():
+    assert_all_engines([1, 2, 3], "(range 1 3)")
+    assert_all_engines([], "(range 2 1)")
+    assert_all_engines(True, "(empty (range 2 1))")
+    assert_all_engines([3], "(tail (tail (range 1 3)))")
+    with assert_raises_regexp(LispError, 'must be integers'):
+        evaluate(parse("(range 1 #t)"), Environment())
+
+def test_infinite_lists():
+    assert_all_engines([0, 1, 2, 3], "(take 4 (iterate (lambda (x) (+ x 1)) 0))")
+    assert_all_engines([1, 2, 4, 8], "(take 4 (iterate (lambda (x) (* x 2)) 1))")
+    assert_all_engines([], "(take 0 (iterate (lambda (x) (head '())) 1))")
+
+def test_lazy_map_and_filter():
+    assert_all_engines([1, 4, 9], "(lazy-map (lambda (x) (* x x)) (range 1 3))")
+    assert_all_engines([2, 4], "(lazy-filter (lambda (x) (eq (mod x 2) 0)) '(1 2 3 4 5))")
+    assert_all_engines([10, 30],
+        "(take 2 (lazy-filter (lambda (x) (> x 5)) "
+        "(lazy-map (lambda (x) (* x 10)) (iterate (lambda (x) (+ x 2)) 1))))")
+
+def test_elements_are_computed_when_needed():
+    for engine in engines:
+        calls = []
+        env = counting_env(calls)
+        engine(parse("(define xs (lazy-map (lambda (x) (tick)) (range 1 100)))"), env)
+        assert_equals([], calls)
+        assert_equals(2, engine(parse("(head (tail xs))"), env))
+        assert_equals(2, engine(parse("(head (tail xs))"), env))
+        assert_equals(2, len(calls))
+
+def test_lazy_lists_in_lisp():
+    env = Environment()
+    interpret("""(define ints-from
+                     (lambda (n) (lazy-cons n (delay (ints-from (+ n 1))))))""", env)
+    assert_equals("(5 6 7)", interpret("(take 3 (ints-from 5))", env))
+    assert_equals("(6 8)", interpret(
+        "(take 2 (lazy-filter (lambda (x) (eq (mod x 2) 0)) (ints-from 5)))", env))
+
+def test_builtins_on_lazy_lists():
+    env = Environment()
+    assert_equals("5050", interpret("(sum (range 1 100))", env))
+    assert_equals("100", interpret("(length (range 1 100))", env))
+    assert_equals("(1 2 3 4)", interpret("(append (range 1 2) (range 3 4))", env))
+    assert_equals("(2 4)", interpret("(map (lambda (x) (* x 2)) (range 1 2))", env))
+    assert is_list(evaluate(parse("(range 1 2)"), env))
+
+def test_walking_from_python_computes_each_element_once():
+    for engine in engines:
+        calls = []
+        env = counting_env(calls)
+        engine(parse("(define xs (lazy-map (lambda (x) (tick)) (range 1 100)))"), env)
+        assert_equals(5050, engine(parse("(sum xs)"), env))
+        assert_equals(5050, engine(parse("(sum xs)"), env))
+        assert_equals(100, engine(parse("(length xs)"), env))
+        assert_equals("(1 2 3)", unparse(engine(parse("(take 3 xs)"), env)))
+        assert_equals(100, len(calls))
+
+    numbers = lazy_range(1, 100000)
+    assert_equals(5000050000, native_sum(numbers))
+    assert_equals(5000050000, native_sum(numbers))
+
+def test_walking_a_lazy_list_keeps_only_the_cells_ahead():
+    # The cells alive when the last element is computed, however long the
+    # list: the head is not kept while the builtin walks it.
+    def cells_alive(source, n):
+        alive = []
+        def count(x):
+            if x == n:
+                alive.append(sum(1 for o in gc.get_objects() if type(o) is LazySeq))
+            return x
+        env = Environment({'count': Builtin('count', 1, count)})
+        for engine in ['evaluate', 'analyze', 'vm', 'continuations']:
+            interpret(source % n, env, engine)
+        return alive
+
+    for source in ["(sum (lazy-map count (range 1 %d)))",
+                   "(length (lazy-filter (lambda (x) (count x)) (range 1 %d)))",
+                   "(sum (take 1000000 (lazy-map count (range 1 %d))))",
+                   "(sum (map (lambda (x) x) (lazy-map count (range 1 %d))))"]:
+        alive = cells_alive(source, 1000)
+        assert max(alive) < 10
+        assert_equals(alive, cells_alive(source, 10000))
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp, with_setup
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from diylisp.interpreter import interpret, load_library, library_index
+from diylisp.types import Environment, LispError
+
+"""
+Library files are loaded by indexing their definitions, which are evaluated
+only when their names are first looked up.
+"""
+
+directory = None
+path = None
+
+def make_directory():
+    global directory, path
+    directory = mkdtemp()
+    path = join(directory, 'library.diy')
+
+def remove_directory():
+    rmtree(directory)
+
+def write(source):
+    with open(path, 'w') as sourcefile:
+        sourcefile.write(source)
+
+@with_setup(make_directory, remove_directory)
+def test_definitions_are_evaluated_when_looked_up():
+    write("""(define x 42)
+             (define broken (no-such-function))""")
+    env = Environment()
+    load_library(path, env)
+    assert_equals({}, env.variables)
+    assert_equals(42, env.lookup('x'))
+    assert_equals({'x': 42}, env.variables)
+    with assert_raises_regexp(LispError, "no-such-function"):
+        env.lookup('broken')
+
+@with_setup(make_directory, remove_directory)
+def test_dependencies_are_evaluated_in_turn():
+    write("""(define quadruple (lambda (n) (double (double n))))
+             (define double (lambda (n) (* 2 n)))
+             (define twelve (quadruple 3))""")
+    for engine in ['evaluate', 'analyze', 'vm', 'continuations']:
+        env = Environment()
+        load_library(path, env, engine)
+        assert_equals("12", interpret("twelve", env, engine))
+        assert_equals(set(['twelve', 'quadruple', 'double']), set(env.variables))
+        assert_equals("20", interpret("((lambda (x) (double x)) 10)", env.extend({}), engine))
+
+@with_setup(make_directory, remove_directory)
+def test_long_chains_of_dependencies():
+    write("(define a0 0)\n" + "".join("(define a%d (+ a%d 1))\n" % (i, i - 1)
+                                       for i in range(1, 200)))
+    for engine in ['evaluate', 'analyze', 'vm', 'continuations']:
+        env = Environment()
+        load_library(path, env, engine)
+        assert_equals("199", interpret("a199", env, engine))
+
+    # Definitions further on are evaluated as they are needed.
+    write("(define x (+ y 1)) (define y (+ z 1)) (define z 1) (define w 0)")
+    env = Environment()
+    load_library(path, env)
+    assert_equals(3, env.lookup('x'))
+    assert_equals(['w'], env.library.keys())
+
+@with_setup(make_directory, remove_directory)
+def test_missing_symbol():
+    write("(define x 1)")
+    env = Environment()
+    load_library(path, env)
+    with assert_raises_regexp(LispError, "^y$"):
+        env.lookup('y')
+
+@with_setup(make_directory, remove_directory)
+def test_library_names_cannot_be_defined_again():
+    write("(define x 1) (define map (lambda (f xs) 'mine))")
+    env = Environment()
+    load_library(path, env)
+    assert env.defines('x')
+    with assert_raises_regexp(LispError, "already defined: x"):
+        interpret("(define x 2)", env)
+    with assert_raises_regexp(LispError, "already defined: x"):
+        load_library(path, env)
+    assert_equals("mine", interpret("(map length '())", env))
+
+@with_setup(make_directory, remove_directory)
+def test_library_hides_builtins_looked_up_before():
+    write("(define sum (lambda (l) 'mine))")
+    for engine in ['evaluate', 'analyze']:
+        env = Environment()
+        interpret("(define f (lambda (x) (sum x)))", env, engine, optimize=False)
+        interpret("(f '(1))", env, engine, optimize=False)
+        assert_equals("1", interpret("(f '(1))", env, engine, optimize=False))
+        load_library(path, env, engine)
+        assert_equals("mine", interpret("(f '(1))", env, engine, optimize=False))
+
+@with_setup(make_directory, remove_directory)
+def test_other_expressions_are_evaluated_right_away():
+    write("(define x 1) (define y (+ x 1)) (define z) (foo)")
+    with assert_raises_regexp(LispError, "Wrong number of arguments"):
+        load_library(path, Environment())
+
+@with_setup(make_directory, remove_directory)
+def test_index_is_made_again_when_the_file_changes():
+    write("(define x 1)")
+    index = library_index(path)
+    assert library_index(path) is index
+    write("(define x 1) (define y 2)")
+    assert_equals([['define', 'x', 1], ['define', 'y', 2]], library_index(path)[0])
+    write("(define x 1) (define x 2)")
+    with assert_raises_regexp(LispError, "already defined: x"):
+        library_index(path)
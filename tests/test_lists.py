@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp, assert_is, \
+    assert_is_instance
+
+from diylisp import lists
+from diylisp.ast import is_list, is_atom
+from diylisp.evaluator import evaluate
+from diylisp.interpreter import interpret
+from diylisp.parser import parse, unparse
+from diylisp.types import Cons, ListView, Environment, LispError
+
+"""
+Lists built by `cons` are chains of cells, which Lisp code, `unparse` and
+`==` should not be able to tell apart from plain Python lists.
+"""
+
+def test_cons_makes_cells_sharing_the_tail():
+    env = Environment({"rest": [2, 3]})
+    lst = evaluate(parse("(cons 1 rest)"), env)
+    assert_is_instance(lst, Cons)
+    assert_is(env.lookup("rest"), evaluate(parse("(tail (cons 1 rest))"), env))
+
+def test_cells_equal_python_lists():
+    lst = Cons(1, Cons(2, [3]))
+    assert_equals([1, 2, 3], lst)
+    assert_equals(lst, [1, 2, 3])
+    assert_equals(Cons(1, []), Cons(1, []))
+    assert lst != [1, 2]
+    assert lst != Cons(1, [2, 4])
+    assert lst != "foo"
+
+def test_operations_on_both_kinds_of_lists():
+    assert_equals(1, lists.head(Cons(1, [])))
+    assert_equals(1, lists.head([1, 2]))
+    assert_equals([2, 3], lists.tail([1, 2, 3]))
+    assert_equals([], lists.tail([1]))
+    assert_equals(False, lists.is_empty(Cons(1, [])))
+    assert_equals(True, lists.is_empty(lists.tail(Cons(1, []))))
+    assert_equals(True, lists.is_empty([]))
+
+def test_tail_of_python_list_is_a_view():
+    items = [1, 2, 3]
+    rest = lists.tail(lists.tail(items))
+    assert_is_instance(rest, ListView)
+    assert_is(items, rest.items)
+    assert_equals(3, lists.head(rest))
+    assert_equals([3], rest)
+    assert_equals(rest, Cons(3, []))
+    assert_equals(True, lists.is_empty(lists.tail(rest)))
+    assert_equals([], lists.tail(lists.tail(rest)))
+
+def test_views_are_lists():
+    view = lists.tail([1, 2, 3])
+    assert is_list(view)
+    assert not is_atom(view)
+    assert_equals("(2 3)", unparse(view))
+    assert_equals("(0 2 3)", unparse(Cons(0, view)))
+    assert_equals(False, evaluate(parse("(eq rest rest)"), Environment({"rest": view})))
+    assert_equals(True, evaluate(parse("(empty (tail (tail rest)))"),
+                                 Environment({"rest": view})))
+
+def test_errors():
+    with assert_raises_regexp(LispError, "empty list"):
+        lists.head(lists.tail(Cons(1, [])))
+    with assert_raises_regexp(LispError, "non-list: 2"):
+        evaluate(parse("(cons 1 2)"), Environment())
+
+def test_unparse():
+    assert_equals("(1 (2 #t) foo)", unparse(Cons(1, Cons(Cons(2, [True]), ["foo"]))))
+    assert_equals("(1 2)", interpret("(cons 1 (cons 2 '()))"))
+
+def test_walking_long_list():
+    for engine in ['evaluate', 'analyze', 'vm', 'continuations']:
+        env = Environment()
+        interpret("""
+            (define build
+                (lambda (n acc)
+                    (if (eq n 0)
+                        acc
+                        (build (- n 1) (cons n acc)))))
+        """, env, engine)
+        interpret("""
+            (define last
+                (lambda (l)
+                    (if (empty (tail l))
+                        (head l)
+                        (last (tail l)))))
+        """, env, engine)
+        assert_equals("10000", interpret("(last (build 10000 '()))", env, engine))
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp, assert_raises, \
+    assert_is_instance
+
+from diylisp import analyzer, continuations, vm
+from diylisp.evaluator import evaluate, call_function
+from diylisp.interpreter import interpret, load_stdlib
+from diylisp.lists import tail
+from diylisp.natives import vectorize, pipeline, builtins
+from diylisp.parser import parse
+from diylisp.types import Builtin, Closure, Cons, Environment, LispError
+
+"""
+The list functions of the standard library are builtins implemented in
+Python, which every environment sees. The Lisp versions can be loaded on
+top of them for reference.
+"""
+
+engines = [evaluate, analyzer.execute, vm.execute, continuations.execute]
+
+def assert_all_engines(expected, source, env_factory=Environment):
+    for engine in engines:
+        assert_equals(expected, engine(parse(source), env_factory()))
+
+def test_builtins_are_in_every_environment():
+    env = Environment()
+    assert_is_instance(env.lookup("map"), Builtin)
+    assert env.defines("sum")
+    assert_equals("<builtin sum>", interpret("sum"))
+    assert_equals("#t", interpret("(atom length)"))
+
+def test_list_functions():
+    assert_all_engines(10, "(sum '(1 2 3 4))")
+    assert_all_engines(0, "(sum '())")
+    assert_all_engines(3, "(length (cons 1 (tail '(0 2 3))))")
+    assert_all_engines([1, 2, 3, 4], "(append (cons 1 '()) (tail '(1 2 3 4)))")
+    assert_all_engines([], "(append '() '())")
+    assert_all_engines([2, 4], "(filter (lambda (x) (eq (mod x 2) 0)) '(1 2 3 4 5))")
+    assert_all_engines([2, 3, 4], "(map (lambda (x) (+ x 1)) (cons 1 '(2 3)))")
+    assert_all_engines([1, 2], "(map (lambda (l) (head l)) (quote ((1 a) (2 b))))")
+
+def test_builtins_as_arguments():
+    assert_all_engines([3, 0, 1], "(map length '((1 2 3) () (a)))")
+    assert_all_engines([[1, 2], [3]], "(filter length '((1 2) () (3)))")
+
+def test_append_shares_the_second_list():
+    right = [3, 4]
+    result = evaluate(parse("(append '(1 2) right)"), Environment({"right": right}))
+    assert_is_instance(result, Cons)
+    assert right is tail(tail(result))
+
+def test_errors():
+    for engine in engines:
+        with assert_raises_regexp(LispError, "wrong number of arguments, expected 2 got 1"):
+            engine(parse("(map '(1 2))"), Environment())
+        with assert_raises_regexp(LispError, "non-list: 5"):
+            engine(parse("(length 5)"), Environment())
+        with assert_raises_regexp(LispError, "Arguments must be integers"):
+            engine(parse("(sum '(1 a))"), Environment())
+        with assert_raises_regexp(LispError, "not a function: 1"):
+            engine(parse("(map 1 '(1 2))"), Environment())
+
+def test_builtins_may_be_defined_again():
+    env = Environment()
+    interpret("(define sum (lambda (l) 'mine))", env)
+    assert_equals("mine", interpret("(sum '(1 2))", env))
+    assert_equals("3", interpret("(sum '(1 2))"))
+    with assert_raises_regexp(LispError, "already defined: sum"):
+        interpret("(define sum 1)", env)
+
+def test_defining_a_builtin_again_after_calling_it():
+    for engine in ['evaluate', 'analyze', 'vm', 'continuations']:
+        env = Environment()
+        interpret("(define f (lambda (x) (sum x)))", env, engine, optimize=False)
+        interpret("(define g (lambda () sum))", env, engine, optimize=False)
+        for _ in range(2):
+            assert_equals("3", interpret("(f '(1 2))", env, engine, optimize=False))
+            assert_equals("<builtin sum>", interpret("(g)", env, engine, optimize=False))
+        interpret("(define sum (lambda (l) 'mine))", env, engine, optimize=False)
+        assert_equals("mine", interpret("(f '(1 2))", env, engine, optimize=False))
+        assert_equals("<closure/1>", interpret("(g)", env, engine, optimize=False))
+
+def test_functions_are_called_back_by_the_calling_engine():
+    for engine in ['vm', 'continuations']:
+        env = Environment()
+        interpret("""
+            (define deep
+                (lambda (n) (if (eq n 0) 0 (+ 1 (deep (- n 1))))))
+        """, env, engine)
+        assert_equals("(5000)", interpret("(map deep '(5000))", env, engine))
+        assert_equals("(5000)", interpret(
+            "(take 1 (lazy-map deep '(5000)))", env, engine))
+
+    env = Environment()
+    env.set('wrap', Closure(env, ['x'], parse("(cons x '())")))
+    assert_equals("((1))", interpret("(map wrap '(1))", env, 'analyze'))
+    assert hasattr(env.lookup('wrap'), 'proc')
+
+def test_same_results_as_reference():
+    native, reference = Environment(), Environment()
+    load_stdlib(native)
+    load_stdlib(reference, reference=True)
+    assert_is_instance(reference.lookup("map"), Closure)
+    for source in ["(sum '(1 2 3))",
+                   "(length '(1 #t 'a))",
+                   "(append '(1 2) '(3 4 5))",
+                   "(append '() '(1))",
+                   "(filter (lambda (x) (> x 2)) '(1 2 3 4))",
+                   "(map (lambda (x) (* x x)) '(1 2 3))",
+                   "(map not '())"]:
+        assert_equals(interpret(source, reference), interpret(source, native))
+
+def test_long_lists():
+    env = Environment({"numbers": range(200000)})
+    assert_equals(str(sum(range(200000))), interpret("(sum numbers)", env))
+    assert_equals("200000", interpret("(length (append numbers '()))", env))
+    assert_equals("1999", interpret(
+        "(length (filter (lambda (x) (eq (mod x 10) 0)) (tail (tail numbers))))",
+        Environment({"numbers": range(20000)})))
+
+def test_vectorized_results_same_as_element_by_element():
+    env = Environment({"numbers": range(-5, 40), "big": [2 ** 62, 3]})
+    env.set("slow-map", Builtin("slow-map", 2,
+            lambda f, l: [call_function(f, [x]) for x in l]))
+    env.set("slow-filter", Builtin("slow-filter", 2,
+            lambda f, l: [x for x in l if call_function(f, [x])]))
+    for body in ["x", "7", "(+ x 1)", "(* (- x 3) (+ x 2) 2)", "(/ 100 (+ 50 x))",
+                 "(mod x 3)", "(> x 3)", "(+ (> x 3))", "(+ (> x 3) 1)",
+                 "(> (* x x) 20)", "(+ 1 2)"]:
+        for name in ["map", "filter"]:
+            fast = "(%s (lambda (x) %s) numbers)" % (name, body)
+            slow = "(slow-%s (lambda (x) %s) numbers)" % (name, body)
+            assert_equals(interpret(slow, env), interpret(fast, env))
+    assert_equals("(18446744073709551616 12)",
+                  interpret("(map (lambda (x) (* x 4)) big)", env))
+
+def test_vectorize_only_integer_math_on_the_parameter():
+    numbers = [1, 2, 3]
+    def closure(source, env=Environment({"y": 1})):
+        return evaluate(parse(source), env)
+    assert vectorize(closure("(lambda (x) (+ x 1))"), numbers) is not None
+    assert vectorize(closure("(lambda (x) (+ x y))"), numbers) is None
+    assert vectorize(closure("(lambda (x) (eq x 1))"), numbers) is None
+    assert vectorize(closure("(lambda (x z) (+ x 1))"), numbers) is None
+    assert vectorize(closure("(lambda (x) (+ x 1))"), [1, True]) is None
+    assert vectorize(Environment().lookup("length"), numbers) is None
+
+def test_vectorized_errors_same_as_element_by_element():
+    for engine in engines:
+        with assert_raises_regexp(LispError, "Arguments must be integers"):
+            engine(parse("(map (lambda (x) (+ x 1)) '(1 a 3))"), Environment())
+    with assert_raises(ZeroDivisionError):
+        interpret("(map (lambda (x) (/ 1 x)) '(1 0 3))")
+
+def test_pipeline_runs_over_chunks():
+    env = Environment()
+    interpret("(define xs (ivec->list (irange 0 10000)))", env)
+    for source in ["(sum (map (lambda (x) (if (eq x 7) 0 x)) (filter (lambda (x) (atom x)) xs)))",
+                   "(length (filter (lambda (x) (if (eq x 7) #f (eq x 9000))) xs))",
+                   "(map (lambda (x) (if (eq x 9) 2 x)) (map (lambda (x) x) xs))"]:
+        assert_equals(interpret(source, env, optimize=False),
+                      interpret(source, env))
+
+def test_pipeline_makes_the_calls_if_the_names_are_not_the_builtins():
+    calls = []
+    def logged_map(function, lst):
+        calls.append(lst)
+        return [call_function(function, [x]) for x in lst]
+    double = evaluate(parse("(lambda (x) (* x 2))"), Environment())
+    run = pipeline(['sum', 'map'])
+    assert_equals(12, run.function(builtins['sum'], Builtin('map', 2, logged_map),
+                                   double, [1, 2, 3]))
+    assert_equals([[1, 2, 3]], calls)
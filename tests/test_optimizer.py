@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises, assert_raises_regexp
+import re
+
+from diylisp.evaluator import evaluate
+from diylisp.interpreter import interpret
+from diylisp.optimizer import optimize
+from diylisp.parser import parse
+from diylisp.types import LispError, Environment
+
+"""
+Tests for the optimizer, which rewrites ASTs before they are evaluated.
+"""
+
+def test_folds_constant_math():
+    assert_equals(7, optimize(parse("(+ 1 (* 2 3))")))
+    assert_equals(True, optimize(parse("(> (mod 7 4) 2)")))
+    assert_equals(parse("(+ x 6)"), optimize(parse("(+ x (* 2 3))")))
+
+def test_leaves_math_which_would_fail():
+    assert_equals(parse("(/ 1 0)"), optimize(parse("(/ 1 0)")))
+    assert_equals(parse("(+ 1 'foo)"), optimize(parse("(+ 1 'foo)")))
+
+def test_prunes_if_with_constant_condition():
+    assert_equals(42, optimize(parse("(if #f (this should not be evaluated) 42)")))
+    assert_equals("a", optimize(parse("(if (> 2 1) a b)")))
+    assert_equals(parse("(if c 1 2)"), optimize(parse("(if c (+ 0 1) 2)")))
+
+def test_unquotes_constants():
+    assert_equals(5, optimize(parse("'5")))
+    assert_equals(parse("'foo"), optimize(parse("'foo")))
+    assert_equals(parse("'(+ 1 2)"), optimize(parse("'(+ 1 2)")))
+
+def test_propagates_defined_constants():
+    env = Environment()
+    evaluate(parse("(define size 10)"), env)
+    assert_equals(parse("(lambda (n) (> n 20))"),
+                  optimize(parse("(lambda (n) (> n (* 2 size)))"), env))
+
+def test_parameters_shadow_defined_constants():
+    env = Environment({"x": 1})
+    assert_equals(parse("(lambda (x) (+ x 1))"),
+                  optimize(parse("(lambda (x) (+ x 1))"), env))
+    assert_equals(parse("(define y x)"), optimize(parse("(define y x)")))
+
+def test_leaves_malformed_forms():
+    assert_equals(parse("(if #t 1)"), optimize(parse("(if #t 1)")))
+    assert_equals(parse("(lambda x 1)"), optimize(parse("(lambda x 1)")))
+
+def test_does_not_change_the_ast():
+    ast = parse("(lambda (n) (if #t (+ 1 2) n))")
+    optimize(ast)
+    assert_equals(parse("(lambda (n) (if #t (+ 1 2) n))"), ast)
+
+def test_same_results_as_without_optimizing():
+    env = Environment()
+    interpret("(define limit 3)", env)
+    interpret("""
+        (define count
+            (lambda (n)
+                (if (> n (+ limit (- 2 2)))
+                    n
+                    (count (+ n (* 1 1))))))
+    """, env)
+    assert_equals(interpret("(count 0)", env, optimize=False),
+                  interpret("(count 0)", env))
+    with assert_raises_regexp(LispError, "not a function: 3"):
+        interpret("(limit 1)", env)
+    with assert_raises(ZeroDivisionError):
+        interpret("(/ limit 0)", env)
+
+def stdlib_env():
+    env = Environment()
+    interpret("(define not (lambda (b) (if b #f #t)))", env)
+    interpret("(define both (lambda (l r) (if l r #f)))", env)
+    interpret("(define <= (lambda (l r) (if (> l r) #f #t)))", env)
+    return env
+
+def test_inlines_small_closures():
+    env = stdlib_env()
+    assert_equals(parse("(if (> x 1) #f #t)"), optimize(parse("(not (> x 1))"), env))
+    assert_equals(parse("(lambda (x) (if (if (> 10 x) #f #t) (eq x 5) #f))"),
+                  optimize(parse("(lambda (x) (both (<= 10 x) (eq x 5)))"), env))
+    assert_equals(False, optimize(parse("(not #t)"), env))
+
+def test_inlining_keeps_arguments_evaluated():
+    """Arguments which may fail must be evaluated just like in a call."""
+
+    env = stdlib_env()
+    ast = parse("(lambda (x) (both x (head x)))")
+    assert_equals(ast, optimize(ast, env))
+    with assert_raises_regexp(LispError, "empty list"):
+        interpret("(both #f (head '()))", env)
+
+def test_inlining_keeps_argument_order():
+    env = stdlib_env()
+    interpret("(define swap (lambda (a b) (+ b a)))", env)
+    ast = parse("(lambda (x) (swap (head x) (tail x)))")
+    assert_equals(ast, optimize(ast, env))
+
+def test_no_inlining_of_shadowed_or_large_closures():
+    env = stdlib_env()
+    ast = parse("(lambda (not) (not #t))")
+    assert_equals(ast, optimize(ast, env))
+    interpret("""
+        (define big
+            (lambda (x)
+                (+ x (+ x (+ x (+ x (+ x (+ x (+ x 1)))))))))
+    """, env)
+    assert_equals(parse("(big y)"), optimize(parse("(big y)"), env))
+    assert_equals(parse("(not y)"), optimize(parse("(not y)"), env, inline=False))
+
+def test_no_inlining_of_special_forms_as_arguments():
+    for engine in ['evaluate', 'analyze', 'vm', 'continuations']:
+        env = Environment()
+        interpret("(define apply1 (lambda (f a) (f a)))", env, engine)
+        for form in ['quote', 'if', '+']:
+            ast = parse("(apply1 %s 1)" % form)
+            assert_equals(ast, optimize(ast, env))
+            with assert_raises_regexp(LispError, "^%s$" % re.escape(form)):
+                interpret("(apply1 %s 1)" % form, env, engine)
+
+def test_no_inlining_of_closures_using_builtins():
+    """A frame between the closure and the call may define the builtin again."""
+
+    for engine in ['evaluate', 'analyze', 'vm', 'continuations']:
+        env = Environment()
+        interpret("(define total (lambda (l) (sum l)))", env, engine)
+        interpret("""
+            (define g
+                (lambda (l)
+                    ((lambda (d) (total l))
+                     (define sum (lambda (x) 'mine)))))
+        """, env, engine)
+        assert_equals("6", interpret("(g '(1 2 3))", env, engine))
+        assert_equals("6", interpret("(g '(1 2 3))", env, engine, optimize=False))
+
+def test_inlining_recursive_closure_terminates():
+    env = Environment()
+    interpret("(define loop (lambda (n) (loop n)))", env)
+    assert_equals(parse("(loop 1)"), optimize(parse("(loop 1)"), env))
+
+def test_fuses_nested_list_builtins():
+    env = Environment()
+    interpret("(define f (lambda (x) (if (eq x 0) 1 x)))", env)
+    ast = optimize(parse("(sum (map f (filter (lambda (x) (atom x)) xs)))"), env)
+    assert_equals("<builtin pipeline>", str(ast[0]))
+    assert_equals(parse("(sum map f filter (lambda (x) (atom x)) xs)"), ast[1:])
+    assert_equals(parse("(sum xs)"), optimize(parse("(sum xs)"), env))
+    assert_equals(parse("(lambda (map) (sum (map f xs)))"),
+                  optimize(parse("(lambda (map) (sum (map f xs)))"), env))
+
+def test_fused_pipelines_give_the_same_results():
+    env = Environment()
+    interpret("(define xs '(1 2 3 4 5 6))", env)
+    interpret("(define odd (lambda (x) (if (eq x 1) #t (if (eq x 3) #t (eq x 5)))))", env)
+    interpret("(define sq (lambda (x) (if (eq x 2) 4 (if (eq x 3) 9 x))))", env)
+    for source in ["(sum (map sq (filter odd xs)))",
+                   "(length (filter odd (map sq xs)))",
+                   "(map sq (map (lambda (x) (if (eq x 1) 0 x)) xs))",
+                   "(filter odd (filter (lambda (x) (atom x)) (range 1 10)))",
+                   "(sum (map (lambda (x) 2) xs))"]:
+        assert_equals("<builtin pipeline>", str(optimize(parse(source), env)[0]))
+        assert_equals(interpret(source, env, optimize=False),
+                      interpret(source, env))
+
+def test_fused_pipelines_keep_errors():
+    env = Environment()
+    with assert_raises_regexp(LispError, "non-list: 1"):
+        interpret("(sum (map (lambda (x) x) 1))", env)
+    with assert_raises_regexp(LispError, "must be integers"):
+        interpret("(sum (map (lambda (x) 'a) '(1 2)))", env)
+    with assert_raises_regexp(LispError, "not a function: 2"):
+        interpret("(length (map 2 '(1 2)))", env)
+
+def test_only_pure_functions_are_fused():
+    """The nested calls make all the calls of each function in turn, which
+    decides which error comes first."""
+
+    env = Environment()
+    interpret("(define xs (range 1 10000))", env)
+    source = """(sum (map (lambda (x) (if (eq x 1) mapfail x))
+                          (filter (lambda (x) (if (eq x 9000) filterfail #t)) xs)))"""
+    assert_equals('sum', optimize(parse(source), env)[0])
+    for optimized in [False, True]:
+        with assert_raises_regexp(LispError, "filterfail"):
+            interpret(source, env, optimize=optimized)
+
+    interpret("(define inc (lambda (x) (+ x 1)))", env)
+    interpret("(define same (lambda (x) x))", env)
+    assert_equals('sum', optimize(parse("(sum (map inc xs))"), env)[0])
+    assert_equals('sum', optimize(parse("(sum (map (lambda (x y) x) xs))"), env)[0])
+    assert_equals('sum', optimize(parse("(lambda (f) (sum (map f xs)))"), env)[2][0])
+    assert_equals("<builtin pipeline>",
+                  str(optimize(parse("(sum (map same xs))"), env)[0]))
+
+def test_fused_pipelines_see_later_definitions():
+    """A pipeline made before a builtin is defined again calls the new one."""
+
+    env = Environment()
+    interpret("(define total (lambda (xs) (sum (map (lambda (x) x) xs))))", env)
+    interpret("(define sum (lambda (xs) 42))", env)
+    assert_equals("42", interpret("(total '(1 2))", env))
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp
+from StringIO import StringIO
+from tempfile import mkstemp
+import os
+
+from diylisp import interpreter, parser
+from diylisp.interpreter import interpret_file
+from diylisp.parser import parse, parse_multiple, read_forms, read_mapped_forms
+from diylisp.types import LispError, Environment
+
+"""
+The parser reads the source in a single pass over its tokens, keeping the
+lists being read on an explicit stack. Files are read a chunk at a time,
+or from a memory map if they are large.
+"""
+
+def test_deep_nesting():
+    depth = 5000
+    ast = parse("(" * depth + "x" + ")" * depth)
+    for _ in range(depth - 1):
+        ast = ast[0]
+    assert_equals(['x'], ast)
+
+def test_parse_multiple():
+    source = """
+        (define x 1) ; a comment
+        'foo
+        -42 #f
+        ; a comment at the end, without a newline"""
+    assert_equals([['define', 'x', 1], ['quote', 'foo'], -42, False],
+                  parse_multiple(source))
+    assert_equals([], parse_multiple("  ; nothing\n"))
+
+def test_atoms_end_at_parens_and_comments():
+    assert_equals(['a', ['b'], 'c'], parse("(a(b)c;d\n)"))
+    assert_equals(['-', '-5x', '1-2'], parse("(- -5x 1-2)"))
+
+def test_errors():
+    with assert_raises_regexp(LispError, "Incomplete expression: \\(a \\(b\\)"):
+        parse_multiple("(x) (a (b)  ")
+    with assert_raises_regexp(LispError, "Incomplete expression: '"):
+        parse("'")
+    with assert_raises_regexp(LispError, "Unexpected '\\)'"):
+        parse_multiple("(a) )")
+    with assert_raises_regexp(LispError, "Unexpected '\\)'"):
+        parse("(a ')")
+    with assert_raises_regexp(LispError, "Expected EOF"):
+        parse("a b")
+    with assert_raises_regexp(LispError, "Expected an expression"):
+        parse(" ; only a comment")
+
+def test_read_forms_across_chunks():
+    source = """(define fact ; the factorial
+                    (lambda (n) (if (<= n 1) 1 (* n (fact (- n 1))))))
+                'symbol-longer-than-a-chunk 12345 #t ;end"""
+    original = parser.chunk_size
+    try:
+        for size in [1, 2, 3, 7, 1000]:
+            parser.chunk_size = size
+            assert_equals(parse_multiple(source), list(read_forms(StringIO(source))))
+    finally:
+        parser.chunk_size = original
+
+def test_read_forms_one_at_a_time():
+    forms = read_forms(StringIO("(a) (b) (c"))
+    assert_equals(['a'], next(forms))
+    assert_equals(['b'], next(forms))
+    with assert_raises_regexp(LispError, "Incomplete expression: \\(c"):
+        next(forms)
+
+def test_interpret_file_evaluates_each_form_when_read():
+    env = Environment()
+    path = mkstemp(suffix='.diy')[1]
+    try:
+        with open(path, 'w') as f:
+            f.write("(define x 1)\n(define y (+ x 1))\n(foo (bar")
+        with assert_raises_regexp(LispError, "Incomplete expression"):
+            interpret_file(path, env)
+    finally:
+        os.remove(path)
+    assert_equals(2, env.lookup('y'))
+
+def test_read_mapped_forms():
+    source = "(define x 1) ; comment\n'(a (b c)) -7 #f"
+    path = mkstemp(suffix='.diy')[1]
+    try:
+        with open(path, 'w') as f:
+            f.write(source)
+        with open(path) as f:
+            assert_equals(parse_multiple(source), list(read_mapped_forms(f)))
+        with open(path, 'w') as f:
+            f.write("(a) (b (c)")
+        with open(path) as f:
+            with assert_raises_regexp(LispError, "Incomplete expression: \\(b \\(c\\)"):
+                list(read_mapped_forms(f))
+    finally:
+        os.remove(path)
+
+def test_interpret_file_maps_large_files():
+    original = interpreter.mmap_threshold
+    path = mkstemp(suffix='.diy')[1]
+    try:
+        interpreter.mmap_threshold = 1
+        with open(path, 'w') as f:
+            f.write("(define x 20)\n(+ x 22)")
+        assert_equals("42", interpret_file(path, Environment()))
+    finally:
+        interpreter.mmap_threshold = original
+        os.remove(path)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals
+
+from diylisp import analyzer, continuations, vm
+from diylisp.evaluator import evaluate
+from diylisp.parser import parse
+from diylisp.types import Environment
+
+"""
+Calls in tail position should not use the Python stack. Each of these
+tests goes far deeper than the default Python recursion limit of 1000,
+with each of the engines.
+"""
+
+engines = [evaluate, analyzer.execute, vm.execute, continuations.execute]
+
+def test_tail_recursive_loop():
+    for engine in engines:
+        env = Environment()
+        engine(parse("""
+            (define count-down
+                (lambda (n)
+                    (if (eq n 0)
+                        'done
+                        (count-down (- n 1)))))
+        """), env)
+        assert_equals("done", engine(parse("(count-down 10000)"), env))
+
+def test_tail_recursive_loop_over_list():
+    for engine in engines:
+        env = Environment({"numbers": range(2000)})
+        engine(parse("""
+            (define sum-acc
+                (lambda (l acc)
+                    (if (empty l)
+                        acc
+                        (sum-acc (tail l) (+ acc (head l))))))
+        """), env)
+        assert_equals(sum(range(2000)), engine(parse("(sum-acc numbers 0)"), env))
+
+def test_mutual_tail_recursion():
+    for engine in engines:
+        env = Environment()
+        engine(parse("""
+            (define even
+                (lambda (n) (if (eq n 0) #t (odd (- n 1)))))
+        """), env)
+        engine(parse("""
+            (define odd
+                (lambda (n) (if (eq n 0) #f (even (- n 1)))))
+        """), env)
+        assert_equals(True, engine(parse("(even 5000)"), env))
+        assert_equals(True, engine(parse("(odd 5001)"), env))
+
+def test_tail_call_in_and_or():
+    for engine in engines:
+        env = Environment({"numbers": range(1, 3001)})
+        engine(parse("""
+            (define all-positive
+                (lambda (l)
+                    (or (empty l)
+                        (and (> (head l) 0)
+                             (all-positive (tail l))))))
+        """), env)
+        assert_equals(True, engine(parse("(all-positive numbers)"), env))
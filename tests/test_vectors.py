@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp, assert_is
+
+from diylisp import analyzer, continuations, vm
+from diylisp.ast import is_atom, is_list, is_vector
+from diylisp.evaluator import evaluate
+from diylisp.interpreter import interpret
+from diylisp.parser import parse, unparse
+from diylisp.types import Environment, LispError, Vector
+from diylisp.vectors import from_list
+
+"""
+Vectors are persistent tries with 32 branches per node. Updates give a new
+vector sharing most of its nodes with the old one, which is left unchanged.
+"""
+
+engines = [evaluate, analyzer.execute, vm.execute, continuations.execute]
+
+def assert_all_engines(expected, source, env_factory=Environment):
+    for engine in engines:
+        assert_equals(expected, engine(parse(source), env_factory()))
+
+def test_push_and_nth_across_levels():
+    """Enough elements to need three levels of nodes in the trie."""
+    vector = Vector()
+    for i in range(40000):
+        vector = vector.push(i)
+    assert_equals(40000, len(vector))
+    for i in [0, 31, 32, 33, 1023, 1024, 1055, 1056, 1057, 32767, 32800, 39999]:
+        assert_equals(i, vector.nth(i))
+    assert_equals(range(40000), list(vector))
+
+def test_updates_share_structure():
+    old = from_list(range(2000))
+    new = old.assoc(100, 'changed')
+    assert_equals('changed', new.nth(100))
+    assert_equals(100, old.nth(100))
+    assert_equals(range(2000), list(old))
+    assert_is(old.tail, new.tail)
+    assert_is(old.root[1], new.root[1])
+
+    pushed = old.push('last')
+    assert_is(old.root, pushed.root)
+    assert_equals(2000, len(old))
+    assert_equals('last', pushed.nth(2000))
+
+def test_primitives():
+    assert_all_engines(from_list([1, 2, 3]), "(vector 1 (+ 1 1) 3)")
+    assert_all_engines(Vector(), "(vector)")
+    assert_all_engines(2, "(vector-ref (vector 1 2 3) 1)")
+    assert_all_engines(3, "(vector-length (vector 1 2 3))")
+    assert_all_engines(from_list([1, 'x', 3]), "(vector-assoc (vector 1 2 3) 1 'x)")
+    assert_all_engines(from_list([1, 2]), "(vector-push (vector 1) 2)")
+
+def test_errors():
+    for engine in engines:
+        with assert_raises_regexp(LispError, "index out of range: 3"):
+            engine(parse("(vector-ref (vector 1 2 3) 3)"), Environment())
+        with assert_raises_regexp(LispError, "non-vector: \(1 2\)"):
+            engine(parse("(vector-length '(1 2))"), Environment())
+        with assert_raises_regexp(LispError, "Index must be an integer"):
+            engine(parse("(vector-ref (vector 1) #f)"), Environment())
+        with assert_raises_regexp(LispError, "wrong number of arguments, expected 3 got 2"):
+            engine(parse("(vector-assoc (vector 1) 0)"), Environment())
+
+def test_vectors_are_neither_atoms_nor_lists():
+    vector = from_list([1, 2])
+    assert is_vector(vector)
+    assert not is_atom(vector)
+    assert not is_list(vector)
+    assert_equals(False, evaluate(parse("(atom (vector 1 2))"), Environment()))
+
+def test_unparse():
+    assert_equals("#(1 #t (a b) #())", unparse(from_list([1, True, ['a', 'b'], Vector()])))
+    assert_equals("#(1 2)", interpret("(vector-push (vector 1) 2)"))
+
+def test_binary_search():
+    env = Environment({"numbers": from_list(range(0, 3000, 3))})
+    interpret("""
+        (define search
+            (lambda (v x low high)
+                (if (> low high)
+                    #f
+                    (if (eq x (vector-ref v (/ (+ low high) 2)))
+                        (/ (+ low high) 2)
+                        (if (> x (vector-ref v (/ (+ low high) 2)))
+                            (search v x (+ (/ (+ low high) 2) 1) high)
+                            (search v x low (- (/ (+ low high) 2) 1)))))))
+    """, env)
+    assert_equals("700", interpret("(search numbers 2100 0 999)", env))
+    assert_equals("#f", interpret("(search numbers 2101 0 999)", env))
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp, assert_is_instance
+from os.path import dirname, relpath, join
+
+from diylisp.compiler import compile_ast, disassemble, CALL, JUMP, RETURN, FAIL
+from diylisp.evaluator import evaluate
+from diylisp.interpreter import interpret, interpret_file
+from diylisp.parser import parse
+from diylisp.types import Closure, LispError, Environment
+from diylisp.vm import execute, run
+
+"""
+Tests for the bytecode compiler and the virtual machine running it.
+"""
+
+def assert_same_as_evaluate(source):
+    expected = evaluate(parse(source), Environment())
+    assert_equals(expected, execute(parse(source), Environment()))
+
+def test_compiled_code_ends_with_return():
+    code = compile_ast(parse("(f 1 2)"))
+    assert_equals((CALL, 2), code[-2])
+    assert_equals((RETURN, None), code[-1])
+
+def test_disassemble():
+    code = compile_ast(parse("(if (> x 1) 'big 'small)"))
+    assert_equals("0 LOOKUP x\n"
+                  "1 CONST 1\n"
+                  "2 MATH (gt, 2)\n"
+                  "3 JUMP_IF_FALSE 6\n"
+                  "4 CONST big\n"
+                  "5 RETURN None\n"
+                  "6 CONST small\n"
+                  "7 RETURN None", disassemble(code))
+
+def test_jumps_to_return_are_replaced():
+    """This puts calls in both branches of an `if` in tail position."""
+    code = compile_ast(parse("(if x (f 1) (g 2))"))
+    assert_equals([], [op for op, arg in code if op == JUMP])
+    assert_equals((RETURN, None), code[code.index((CALL, 1)) + 1])
+
+def test_simple_expressions():
+    assert_same_as_evaluate("#f")
+    assert_same_as_evaluate("'(1 2 #f)")
+    assert_same_as_evaluate("(atom 'foo)")
+    assert_same_as_evaluate("(eq 'foo 'bar)")
+    assert_same_as_evaluate("(eq #f (> (- (+ 1 3) (* 2 (mod 7 4))) 4))")
+    assert_same_as_evaluate("(if (> 1 2) (- 1000 1) (+ 40 (- 3 1)))")
+
+def test_lists():
+    assert_same_as_evaluate("(cons 3 (cons (- 4 2) (cons 1 '())))")
+    assert_same_as_evaluate("(head '(1 2 3))")
+    assert_same_as_evaluate("(tail '(1 2 3))")
+    assert_same_as_evaluate("(empty (tail '(1)))")
+    with assert_raises_regexp(LispError, "empty list"):
+        execute(parse("(head '())"), Environment())
+
+def test_malformed_form_fails_only_when_run():
+    code = compile_ast(parse("(if #t 42 (if #t))"))
+    assert_equals(FAIL, code[4][0])
+    assert_equals(42, run(code, Environment()))
+    with assert_raises_regexp(LispError, "too few arguments"):
+        execute(parse("(if #t)"), Environment())
+
+def test_define_and_lambda():
+    env = Environment()
+    execute(parse("(define x 1000)"), env)
+    assert_equals(1000, env.lookup("x"))
+
+    closure = execute(parse("(lambda (x y) (+ x y))"), env)
+    assert_is_instance(closure, Closure)
+    assert_equals(env, closure.env)
+    assert_equals(["+", "x", "y"], closure.body)
+
+def test_call_errors():
+    with assert_raises_regexp(LispError, "not a function"):
+        execute(parse("(42)"), Environment())
+
+    env = Environment()
+    execute(parse("(define fn (lambda (p1 p2) 'whatwever))"), env)
+    with assert_raises_regexp(LispError, "wrong number of arguments, expected 2 got 3"):
+        execute(parse("(fn 1 2 3)"), env)
+
+def test_closures_from_other_engines():
+    env = Environment()
+    evaluate(parse("(define add (lambda (x y) (+ x y)))"), env)
+    assert_equals(5, execute(parse("(add 2 3)"), env))
+    closure = evaluate(parse("(lambda (x) (+ x y))"), Environment({"y": 1}))
+    assert_equals(1, execute([closure, 0], Environment({"y": 2})))
+
+def test_deep_recursion():
+    """Lisp calls do not use the Python stack."""
+
+    env = Environment()
+    execute(parse("""
+        (define count
+            (lambda (n)
+                (if (eq n 0) 0 (+ 1 (count (- n 1))))))
+    """), env)
+    assert_equals(5000, execute(parse("(count 5000)"), env))
+
+def test_profile_counts_instructions():
+    profile = {}
+    run(compile_ast(parse("(+ 1 2)")), Environment(), profile)
+    assert_equals(4, sum(profile.values()))
+
+def test_interpret_on_vm():
+    env = Environment()
+    path = join(dirname(relpath(__file__)), '..', 'stdlib.diy')
+    interpret_file(path, env, engine='vm')
+    assert_equals("#f", interpret("(and #t #f)", env, engine='vm'))
+    assert_equals("10", interpret("(sum '(1 2 3 4))", env, engine='vm'))